@@ -6,3 +6,11 @@ from .devices import (
     SDMDoorbell,
     SDMThermostat,
 )
+
+
+def __getattr__(name):
+    # The asyncio client is imported on first use: asyncio is slow to import
+    if name == "SDMAsyncAPI":
+        from .aio import SDMAsyncAPI
+        return SDMAsyncAPI
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
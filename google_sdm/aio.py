@@ -0,0 +1,380 @@
+import asyncio
+import contextvars
+import time
+from collections import namedtuple
+from typing import List, Optional
+
+from .api import (
+    ENDPOINT_DEVICES,
+    ENDPOINT_STRUCTURES,
+    LOGGER,
+    SDMAPI,
+)
+from .bulk import SDMCommandResult, execute_as_completed_async
+from .coalesce import resolve
+from .metrics import endpoint_label
+from .tracing import traced
+from .devices import SDMDevice
+from .structure import SDMStructure
+
+SDMAsyncResponse = namedtuple(
+    "SDMAsyncResponse",
+    ["status_code", "headers", "content"],
+)
+
+
+class SDMAsyncStructure(SDMStructure):
+    """`SDMStructure` whose network calls are coroutines."""
+
+    async def get_rooms(self, refresh=False):
+        """Get structure rooms, see `SDMStructure.get_rooms`."""
+        if refresh or not self._rooms_warm:
+            self._load_rooms(await self._get("/rooms"))
+        return list(self._rooms)
+
+
+class SDMAsyncAPI(SDMAPI):
+    """Asyncio flavour of `SDMAPI`.
+
+    Requests share a pooled `aiohttp.ClientSession`, so many commands can be
+    in flight at once from one event loop. Devices are the regular
+    `SDMDevice` classes: their `execute_command`, and therefore every trait
+    command such as `ThermostatEcoTrait.SetMode(device, ...)`, return
+    coroutines when bound to this API.
+    """
+
+    STRUCTURE_TYPE = SDMAsyncStructure
+
+    def __init__(self, *args, connection_limit=100, session=None, **kwargs):
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:  # pragma: no cover
+            raise ImportError("SDMAsyncAPI requires the aiohttp package")
+        super().__init__(*args, **kwargs)
+        self._connection_limit = connection_limit
+        self._session = session
+        self._loop = None
+
+    async def __aenter__(self):
+        if self._snapshot_loaded:
+            self.reconcile_in_background()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _client(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._connection_limit),
+            )
+        return self._session
+
+    async def _execute_command(self, device, command, params):
+        """Send a command to a device and, if `optimistic`, apply its
+        declared effect to the device traits once it succeeded."""
+        sent_ns = time.time_ns()
+        result = await device._post(
+            ":executeCommand",
+            {"command": command, "params": params},
+        )
+        if self.optimistic:
+            device._apply_effect(command, params, sent_ns)
+        return result
+
+    def _coalesce(self, coalescer, device, command, params):
+        """Hold a command in `coalescer` and return an awaitable of its
+        result."""
+        future, first = coalescer.submit(device, command, params)
+        if first:
+            self._schedule_coalesced(coalescer, device.name, coalescer.window)
+        return asyncio.wrap_future(future)
+
+    def _schedule_coalesced(self, coalescer, name, delay):
+        asyncio.get_running_loop().call_later(
+            delay, self._flush_coalesced, coalescer, name
+        )
+
+    def _flush_coalesced(self, coalescer, name):
+        delay = coalescer.remaining(name)
+        if delay > 0:
+            self._schedule_coalesced(coalescer, name, delay)
+            return
+        asyncio.ensure_future(self._send_coalesced(*coalescer.take(name)))
+
+    async def _send_coalesced(self, device, commands):
+        """Send the commands of a coalesced burst and resolve their
+        callers."""
+        for index, (command, params, futures) in enumerate(commands):
+            try:
+                result = await device._execute_now(command, params)
+            except asyncio.CancelledError as e:
+                # Leave no caller hanging on the commands not sent
+                for _, _, pending in commands[index:]:
+                    resolve(pending, error=e)
+                raise
+            except Exception as e:
+                resolve(futures, error=e)
+            else:
+                resolve(futures, result)
+
+    async def flush_commands(self):
+        """Send the commands held by `coalescer` without waiting for their
+        window to close."""
+        if self.coalescer is not None:
+            for name in self.coalescer.pending():
+                await self._send_coalesced(*self.coalescer.take(name))
+
+    async def close(self):
+        """Send the held commands, close the pooled HTTP connections, stop
+        the proactive token refresh and save the snapshot, if enabled."""
+        await self.flush_commands()
+        self.token_manager.stop()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self.snapshot_path is not None and self._devices:
+            self.save_snapshot()
+
+    def reconcile_in_background(self) -> Optional[asyncio.Task]:
+        """Refresh the devices, structures and loaded rooms of a snapshot
+        against the API in a task, then save the snapshot. Without a
+        running event loop, the reconcile waits for `__aenter__` or
+        `listen_events`."""
+        if self._reconciler is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return None
+            self._reconciler = loop.create_task(self._reconcile_snapshot())
+        return self._reconciler
+
+    async def _reconcile_snapshot(self):
+        try:
+            await self.get_devices(refresh=True)
+            for structure in await self.get_structures(refresh=True):
+                if structure._rooms is not None:
+                    await structure.get_rooms(refresh=True)
+            if self.snapshot_path is not None:
+                self.save_snapshot()
+        except Exception as e:
+            LOGGER.error(f"Snapshot reconcile failed: {e}")
+
+    async def execute_many(self, commands, max_concurrency=None) \
+            -> List[SDMCommandResult]:
+        """Execute `(device, command, params)` tuples concurrently and
+        return their `SDMCommandResult`s in the order of `commands`. Errors
+        are returned, not raised."""
+        results = [
+            await result
+            for result in self.execute_many_as_completed(
+                commands, max_concurrency
+            )
+        ]
+        results.sort(key=lambda result: result.index)
+        return results
+
+    def execute_many_as_completed(self, commands, max_concurrency=None):
+        """Like `execute_many`, but return awaitables of the
+        `SDMCommandResult`s in completion order. At most `max_concurrency`
+        commands (default: `connection_limit`) are in flight at once."""
+        return execute_as_completed_async(
+            commands,
+            max_concurrency or self._connection_limit,
+        )
+
+    async def _refresh_tokens(self, stale_token):
+        """Refresh the tokens once for all coroutines and threads holding
+        `stale_token`, through `token_manager`."""
+        loop = asyncio.get_running_loop()
+        # Keep the trace context in the executor thread
+        context = contextvars.copy_context()
+        await loop.run_in_executor(
+            None, context.run, self.token_manager.refresh, stale_token
+        )
+
+    async def _request(self, method: str, path: str, **kwargs) \
+            -> SDMAsyncResponse:
+        """Make a request within the quota of `rate_limiter`, retrying
+        throttled and failed responses it allows to retry."""
+        if self.tracer is None:
+            return await self._request_attempts(method, path, **kwargs)
+        with traced(
+            self.tracer, "sdm.request", self._request_attributes(method, path)
+        ) as span:
+            res = await self._request_attempts(method, path, **kwargs)
+            span.set_attribute("http.status_code", res.status_code)
+            return res
+
+    async def _request_attempts(self, method, path, **kwargs):
+        url = f"{self.api_url}{path}"
+        metrics = self.metrics
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.acquire(path)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if metrics.enabled or self.tracer is not None:
+                res = await self._send_observed(method, path, url, **kwargs)
+            else:
+                res = await self._send(method, url, **kwargs)
+            delay = self.rate_limiter.retry_delay(
+                res.status_code, res.headers, attempt
+            )
+            if delay is None:
+                return res
+            LOGGER.warning(
+                f"Request: {method} {url} returned {res.status_code}, "
+                + f"retrying in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send_observed(self, method, path, url, **kwargs) \
+            -> SDMAsyncResponse:
+        """`_send`, recorded in `metrics` and traced by `tracer`."""
+        started = time.perf_counter()
+        status = "error"
+        try:
+            if self.tracer is None:
+                res = await self._send(method, url, **kwargs)
+            else:
+                with traced(self.tracer, "sdm.http", {"http.url": url}) \
+                        as span:
+                    res = await self._send(method, url, **kwargs)
+                    span.set_attribute("http.status_code", res.status_code)
+            status = str(res.status_code)
+            return res
+        finally:
+            if self.metrics.enabled:
+                self.metrics.observe_request(
+                    endpoint_label(path), method, status,
+                    time.perf_counter() - started,
+                )
+
+    async def _send(self, method: str, url: str, **kwargs) \
+            -> SDMAsyncResponse:
+        """Send a single request, refreshing the tokens when they are
+        expired or rejected."""
+        LOGGER.debug(f"Request: {method} {url}")
+
+        token = self._oauth.token
+        if self.token_manager.expired(token):
+            LOGGER.warning("Token expired.")
+            await self._refresh_tokens(token)
+        # E.g. If-None-Match of a conditional GET
+        extra_headers = kwargs.pop("headers", {})
+        for attempt in range(2):
+            token = self._oauth.token
+            headers = {
+                **extra_headers,
+                "Authorization": f"Bearer {token['access_token']}",
+            }
+            async with self._client().request(
+                method.upper(), url, headers=headers, **kwargs
+            ) as res:
+                content = await res.read()
+                if res.status == 401 and attempt == 0:
+                    LOGGER.warning("Token expired.")
+                    await self._refresh_tokens(token)
+                    continue
+                return SDMAsyncResponse(res.status, res.headers, content)
+
+    async def _get(self, endpoint):
+        """Get data as dictionary from an endpoint."""
+        content, kwargs = self._cache_before(endpoint)
+        if content is None:
+            res = await self._request("get", endpoint, **kwargs)
+            content = self._cache_after(endpoint, res)
+        return self._check_get(self._decode(content))
+
+    async def _post(self, endpoint, data):
+        """Post data (as json) to an endpoint."""
+        if self.tracer is None:
+            return await self._post_observed(endpoint, data)
+        with traced(self.tracer, *self._post_span(endpoint, data)):
+            return await self._post_observed(endpoint, data)
+
+    async def _post_observed(self, endpoint, data):
+        started = time.perf_counter() if self.metrics.enabled else None
+        try:
+            res = await self._request(
+                "post", endpoint, data=self.codec.dumps(data)
+            )
+        except Exception:
+            if started is not None:
+                self._observe_command(data, "error", started)
+            raise
+        if started is not None:
+            self._observe_command(data, str(res.status_code), started)
+        self._cache_invalidate(endpoint)
+        return self._check_post(self._decode(res.content))
+
+    async def get_devices(self, refresh=False) -> List[SDMDevice]:
+        """Return a list of `SDMDevice` instances for all
+        devices."""
+        if not self._devices or refresh:
+            self._load_devices(
+                await self._get(ENDPOINT_DEVICES.format(self.project_id))
+            )
+        return self._devices.list()
+
+    async def get_device(self, name) -> Optional[SDMDevice]:
+        """Return the `SDMDevice` with the given name, or None."""
+        if not self._devices:
+            await self.get_devices()
+        return self._devices.get(name)
+
+    async def get_devices_by_type(self, device_type) -> List[SDMDevice]:
+        """Return the `SDMDevice` instances of a type."""
+        if not self._devices:
+            await self.get_devices()
+        return self._devices.by_type(device_type)
+
+    async def get_devices_by_structure(self, structure) -> List[SDMDevice]:
+        """Return the `SDMDevice` instances in a structure."""
+        if not self._devices:
+            await self.get_devices()
+        return self._devices.by_structure(
+            getattr(structure, "name", structure)
+        )
+
+    async def get_devices_by_room(self, room) -> List[SDMDevice]:
+        """Return the `SDMDevice` instances in a room."""
+        if not self._devices:
+            await self.get_devices()
+        return self._devices.by_room(getattr(room, "name", room))
+
+    async def get_structures(self, refresh=False) \
+            -> List[SDMAsyncStructure]:
+        """Return a list of `SDMAsyncStructure` instances for all
+        structures."""
+        if not self._structures or refresh:
+            self._load_structures(
+                await self._get(ENDPOINT_STRUCTURES.format(self.project_id))
+            )
+        return self._structures.list()
+
+    async def listen_events(self, **kwargs):
+        """Load devices and structures, then start handling events with
+        the source and options of `SDMAPI.listen_events`. Listeners run on
+        the source's threads."""
+        if self._snapshot_loaded:
+            self.reconcile_in_background()
+        await self.get_devices()
+        await self.get_structures()
+        self._loop = asyncio.get_running_loop()
+        super().listen_events(**kwargs)
+
+    def _preload_events(self):
+        pass
+
+    def _refresh_relations(self):
+        asyncio.run_coroutine_threadsafe(
+            self._refresh_all(), self._loop
+        ).result()
+
+    async def _refresh_all(self):
+        await self.get_devices(refresh=True)
+        await self.get_structures(refresh=True)
+        self._invalidate_rooms()
@@ -1,8 +1,10 @@
 import json
 import logging
 import os
+import threading
 import time
-from typing import Callable, Dict, Optional, Union, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Union, List
 
 from .devices import (
     SDMDevice,
@@ -12,15 +14,31 @@ from .devices import (
     SDMThermostat,
 )
 
+from .cache import SDMResponseCache
+from .coalesce import SDMCommandCoalescer, resolve
+from .codec import SDMCodec, default_codec
+from .bulk import SDMCommandResult, execute_as_completed
+from .dedup import SDMEventDeduplicator, peek_event_id
+from .dispatch import SDMEventDispatcher
+from .events import SDMEventSource, SDMPubSubEventSource
+from .metrics import SDMMetrics, command_label, endpoint_label
+from .ratelimit import SDMRateLimiter, device_of
+from .registry import SDMDeviceRegistry, SDMStructureRegistry
+from .token import SDMTokenManager
+from .utils import atomic_write
+from .tracing import (
+    SDMTracer,
+    current_span,
+    run_queued,
+    start_queued,
+    traced,
+)
 from .structure import (
     SDMStructure,
 )
 
-from oauthlib.oauth2 import TokenExpiredError
-from requests import Response
-from requests_oauthlib import OAuth2Session
-from google.cloud import pubsub_v1
-from google.oauth2 import service_account
+if TYPE_CHECKING:  # pragma: no cover
+    from requests import Response
 
 API_URL = "https://smartdevicemanagement.googleapis.com/v1/"
 OAUTH2_AUTHORIZE_TEMPLATE = \
@@ -29,6 +47,7 @@ OAUTH2_TOKEN = "https://www.googleapis.com/oauth2/v4/token"
 OAUTH2_SCOPE = "https://www.googleapis.com/auth/sdm.service"
 ENDPOINT_DEVICES = 'enterprises/{}/devices'
 ENDPOINT_STRUCTURES = 'enterprises/{}/structures'
+SNAPSHOT_VERSION = 1
 
 LOGGER = logging.getLogger("google-sdm")
 
@@ -46,6 +65,8 @@ class SDMAPI(object):
         SDMThermostat.STR_REPR: SDMThermostat,
     }
 
+    STRUCTURE_TYPE = SDMStructure
+
     def __init__(
         self,
         token: Optional[Dict[str, str]] = None,
@@ -57,8 +78,24 @@ class SDMAPI(object):
         pubsub_auth_path: str = None,
         pubsub_auth: Optional = None,
         token_updater: Optional[Callable[[str], None]] = None,
+        max_command_workers: int = 16,
+        rate_limiter: Optional[SDMRateLimiter] = None,
+        cache: Optional[SDMResponseCache] = None,
+        codec: Optional[SDMCodec] = None,
+        dispatcher: Optional[SDMEventDispatcher] = None,
+        deduplicator: Union[SDMEventDeduplicator, bool, None] = None,
+        metrics: Optional[SDMMetrics] = None,
+        tracer: Optional[SDMTracer] = None,
+        snapshot_path: Optional[str] = None,
+        token_manager: Optional[SDMTokenManager] = None,
+        coalescer: Optional[SDMCommandCoalescer] = None,
+        optimistic: bool = True,
+        api_url: str = API_URL,
+        token_url: str = OAUTH2_TOKEN,
     ):
         self.project_id = project_id
+        self.api_url = api_url
+        self.token_url = token_url
         self.oauth_authorize = OAUTH2_AUTHORIZE_TEMPLATE.format(project_id)
         self.client_id = client_id
         self.client_secret = client_secret
@@ -68,167 +105,764 @@ class SDMAPI(object):
         self._pubsub_subscription = pubsub_subscription
         self._pubsub_auth_path = pubsub_auth_path
         self._pubsub_auth = pubsub_auth
-        self._devices = []
-        self._structures = []
-        self._event_thread = None
+        self._devices = SDMDeviceRegistry()
+        self._structures = SDMStructureRegistry()
+        self._device_listeners = []
+        self._event_source = None
+        self.max_command_workers = max_command_workers
+        self._command_pool = None
+        self.rate_limiter = rate_limiter or SDMRateLimiter()
+        self.cache = cache
+        self.codec = codec or default_codec()
+        self.dispatcher = dispatcher
+        # None for the default deduplicator, False for none
+        if deduplicator is None:
+            deduplicator = SDMEventDeduplicator()
+        self.deduplicator = deduplicator or None
+        self.metrics = metrics or SDMMetrics()
+        if dispatcher is not None and dispatcher.metrics is None:
+            dispatcher.metrics = self.metrics
+        self.tracer = tracer
+        self.snapshot_path = snapshot_path
+        self._snapshot_loaded = False
+        self._reconciler = None
+        self._oauth_session = None
+        self._oauth_lock = threading.Lock()
+        self.token_manager = token_manager or SDMTokenManager()
+        self.token_manager.attach(self)
+        self.coalescer = coalescer
+        self.optimistic = optimistic
+
+        if snapshot_path is not None and self.load_snapshot() \
+                and token is not None:
+            self.reconcile_in_background()
+
+    @property
+    def _oauth(self):
+        """The OAuth2 session, created on first use: requests and oauthlib
+        are only imported by clients that authorize or make requests."""
+        if self._oauth_session is None:
+            with self._oauth_lock:
+                if self._oauth_session is None:
+                    self._oauth_session = self._create_oauth_session()
+                    self.token_manager.start()
+        return self._oauth_session
+
+    def _create_oauth_session(self):
+        from requests.adapters import HTTPAdapter
+        from requests_oauthlib import OAuth2Session
 
         extra = {
             "client_id": self.client_id,
             "client_secret": self.client_secret
         }
 
-        self._oauth = OAuth2Session(
-            client_id=client_id,
-            redirect_uri=redirect_uri,
-            auto_refresh_url=OAUTH2_TOKEN,
+        # Without auto_refresh_url, expired tokens raise TokenExpiredError
+        # and are refreshed once for all threads by the token manager
+        session = OAuth2Session(
+            client_id=self.client_id,
+            redirect_uri=self.redirect_uri,
             auto_refresh_kwargs=extra,
-            token=token,
-            token_updater=token_updater,
+            token=self.token,
+            token_updater=self.token_updater,
             scope=OAUTH2_SCOPE,
         )
+        # Keep a connection per command worker
+        adapter = HTTPAdapter(pool_maxsize=max(10, self.max_command_workers))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
-    def listen_events(self):
-        if self._event_thread is None:
-            subscriber = None
-            if self._pubsub_auth_path is not None:
-                subscriber = \
-                    pubsub_v1.SubscriberClient.from_service_account_file(
-                        self._pubsub_auth_path
-                    )
-            else:
-                subscriber = pubsub_v1.SubscriberClient(
-                    credentials=service_account.Credentials.from_service_account_info(self._pubsub_auth)
+    def listen_events(
+        self,
+        source: Optional[SDMEventSource] = None,
+        flow_control=None,
+        max_workers: Optional[int] = None,
+        await_callbacks_on_shutdown: bool = True,
+    ):
+        """Start handling the events of `source`, by default an
+        `SDMPubSubEventSource` of the project's subscription, built with
+        `flow_control`, `max_workers` and `await_callbacks_on_shutdown`.
+        See `stop_events` to shut down.
+        """
+        if self._event_source is None:
+            if source is None:
+                source = SDMPubSubEventSource(
+                    self._pubsub_subscription,
+                    auth_path=self._pubsub_auth_path,
+                    auth=self._pubsub_auth,
+                    flow_control=flow_control,
+                    max_workers=max_workers,
+                    await_callbacks_on_shutdown=await_callbacks_on_shutdown,
                 )
+            self._preload_events()
+            source.start(self._handle_message)
+            self._event_source = source
+
+    def stop_events(self, timeout: Optional[float] = None):
+        """Stop the event source, let the callbacks in progress and the
+        dispatcher queue drain. Messages still queued when `timeout`
+        expires are not acked, so Pub/Sub redelivers them."""
+        if self._event_source is None:
+            return
+        self._event_source.stop(timeout)
+        if self.dispatcher is not None:
+            self.dispatcher.stop(timeout)
+        self._event_source = None
+        if self.snapshot_path is not None:
+            self.save_snapshot()
+
+    def _handle_message(self, message):
+        """Route a Pub/Sub message to its device, then ack or nack it."""
+        if self.tracer is None:
+            return self._process_message(message)
+        with traced(self.tracer, "sdm.handle_message", {
+            "messaging.message_id": getattr(message, "message_id", ""),
+        }):
+            return self._process_message(message)
+
+    def _process_message(self, message):
+        metrics = self.metrics
+        tracer = self.tracer
+        event_id = None
+        if self.deduplicator is not None:
+            event_id = peek_event_id(message.data)
+            if event_id is not None and self.deduplicator.seen(event_id):
+                LOGGER.debug(f"Acking duplicate pubsub message: {event_id}")
+                message.ack()
+                if metrics.enabled:
+                    metrics.count_message("ack", "duplicate")
+                return
+
+        settled = False
+
+        def ack(reason, span=True):
+            nonlocal settled
+            settled = True
+            LOGGER.debug(f"Acking pubsub message: {event_id}")
+            message.ack()
+            if metrics.enabled:
+                metrics.count_message("ack", reason)
+            if span and tracer is not None:
+                current_span().set_attribute("sdm.ack", reason)
+
+        def nack(reason, error, span=True):
+            nonlocal settled
+            settled = True
+            LOGGER.error(f"Nacking pubsub message: {event_id}: {error}")
+            if self.deduplicator is not None:
+                self.deduplicator.forget(event_id)
+            message.nack()
+            if metrics.enabled:
+                metrics.count_message("nack", reason)
+            if span and tracer is not None:
+                current_span().set_attribute("sdm.nack", reason)
+
+        def dispatched(callback, msg):
+            # Runs on the shard worker, once the message span has ended:
+            # the message is only acked once its callback succeeded
+            try:
+                callback(msg)
+            except Exception as e:
+                nack("callback_failed", e, span=False)
+                raise
+            ack("dispatched", span=False)
 
-            def generate_callback():
-                if not self._devices:
-                    self.get_devices()
-                if not self._structures:
-                    self.get_structures()
-
-                def handle_message(message):
-                    msg = json.loads(message.data.decode())
-                    event_id = msg["eventId"]
-                    LOGGER.info(f"Received pubsub message: {event_id}")
-                    LOGGER.debug(f"Received pubsub message: {msg}")
-                    relevant_device = None
-                    if "relationUpdate" in msg:
-                        LOGGER.debug(
-                            "Relation update, updating devices and structures"
-                        )
-                        self.get_devices(refresh=True)
-                        self.get_structures(refresh=True)
-                    elif "resourceUpdate" in msg:
-                        for device in self._devices:
-                            if msg["resourceUpdate"]["name"] == device.name:
-                                relevant_device = device
-                        if not relevant_device:
-                            LOGGER.error(
-                                f"Nacking pubsub message: {event_id}: "
-                                + "No relevant device"
-                            )
-                            message.nack()
-                            return
-                        try:
-                            relevant_device.event_callback(msg)
-                            LOGGER.debug(f"Acking pubsub message: {event_id}")
-                            message.ack()
-                        except Exception as e:
-                            LOGGER.error(
-                                f"Nacking pubsub message: {event_id}: "
-                                + f"{e}"
-                            )
-                            message.nack()
+        try:
+            msg = self.codec.loads(message.data)
+            if event_id is None:
+                event_id = msg["eventId"]
+                if self.deduplicator is not None \
+                        and self.deduplicator.seen(event_id):
+                    LOGGER.debug(
+                        f"Acking duplicate pubsub message: {event_id}"
+                    )
+                    message.ack()
+                    if metrics.enabled:
+                        metrics.count_message("ack", "duplicate")
+                    return
+            LOGGER.info(f"Received pubsub message: {event_id}")
+            LOGGER.debug(f"Received pubsub message: {msg}")
+            relevant_device = None
+            if "relationUpdate" in msg:
+                LOGGER.debug(
+                    "Relation update, updating devices and structures"
+                )
+                if self.cache is not None:
+                    self.cache.invalidate()
+                try:
+                    self._refresh_relations()
+                except Exception as e:
+                    nack("relation_failed", e)
+                    return
+                ack("relation")
+            elif "resourceUpdate" in msg:
+                name = msg["resourceUpdate"]["name"]
+                if self.cache is not None:
+                    self.cache.invalidate_device(name)
+                relevant_device = self._devices.get(name)
+                if not relevant_device:
+                    nack("unknown_device", "No relevant device")
+                    return
+                if self.dispatcher is not None:
+                    if tracer is None:
+                        args = (dispatched, relevant_device.event_callback,
+                                msg)
+                    else:
+                        # Trace the queue wait and keep the context across
+                        queued = start_queued(tracer, "sdm.dispatch_queue")
+                        args = (run_queued, *queued, dispatched,
+                                relevant_device.event_callback, msg)
+                    if self.dispatcher.submit(relevant_device.name, *args):
+                        if tracer is not None:
+                            current_span().set_attribute("sdm.ack", "queued")
                     else:
-                        LOGGER.error(
-                            f"Nacking pubsub message: {event_id}: "
-                            + "No processable events"
-                        )
-                        message.nack()
-                return handle_message
-
-            self._event_thread = subscriber.subscribe(
-                self._pubsub_subscription,
-                generate_callback()
+                        if tracer is not None:
+                            queued[0].end()
+                        nack("queue_full", "Dispatch queue full")
+                    return
+                try:
+                    relevant_device.event_callback(msg)
+                except Exception as e:
+                    nack("callback_failed", e)
+                    return
+                ack("resource")
+            else:
+                nack("unprocessable", "No processable events")
+        except Exception as e:
+            # Forget the event so its redelivery isn't taken for a duplicate
+            if not settled:
+                nack("error", e)
+                return
+            raise
+
+    def _preload_events(self):
+        """Load the devices and structures events are routed to."""
+        if self._snapshot_loaded:
+            self.reconcile_in_background()
+        if not self._devices:
+            self.get_devices()
+        if not self._structures:
+            self.get_structures()
+
+    def _refresh_relations(self):
+        """Reload devices and structures after a `relationUpdate`."""
+        self.get_devices(refresh=True)
+        self.get_structures(refresh=True)
+        self._invalidate_rooms()
+
+    def _invalidate_rooms(self):
+        for structure in self._structures:
+            structure._rooms = None
+            structure._rooms_warm = False
+
+    def save_snapshot(self, path: Optional[str] = None):
+        """Write the devices, with their `last_updated` time, the structures
+        and their loaded rooms to `path`, by default `snapshot_path`. The
+        file is replaced atomically."""
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "project_id": self.project_id,
+            "saved_at": time.time(),
+            "devices": [device._snapshot() for device in self._devices],
+            "structures": [
+                structure._snapshot() for structure in self._structures
+            ],
+        }
+        atomic_write(path or self.snapshot_path, self.codec.dumps(snapshot))
+
+    def load_snapshot(self, path: Optional[str] = None) -> bool:
+        """Load the devices, structures and rooms saved by `save_snapshot`
+        to `path`, by default `snapshot_path`, so they can be read without
+        requests. Return whether a snapshot was loaded."""
+        path = path or self.snapshot_path
+        try:
+            with open(path, "rb") as f:
+                snapshot = self.codec.loads(f.read())
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            LOGGER.warning(f"Ignoring unreadable snapshot {path}: {e}")
+            return False
+        if snapshot.get("version") != SNAPSHOT_VERSION \
+                or snapshot.get("project_id") != self.project_id:
+            LOGGER.warning(f"Ignoring snapshot {path} of another version "
+                           + "or project")
+            return False
+
+        self._load_devices({
+            "devices": [entry["resource"] for entry in snapshot["devices"]],
+        })
+        for entry in snapshot["devices"]:
+            device = self._devices.get(entry["resource"]["name"])
+            if device is not None:
+                device.last_updated_ns = entry["last_updated_ns"]
+        self._load_structures({
+            "structures": [
+                entry["resource"] for entry in snapshot["structures"]
+            ],
+        })
+        for entry in snapshot["structures"]:
+            structure = self._structures.get(entry["resource"]["name"])
+            if structure is not None and entry["rooms"] is not None:
+                structure._load_rooms({"rooms": entry["rooms"]}, warm=True)
+        self._snapshot_loaded = True
+        LOGGER.info(f"Loaded snapshot {path} saved at "
+                    + f"{snapshot.get('saved_at')}")
+        return True
+
+    def reconcile_in_background(self) -> threading.Thread:
+        """Refresh the devices, structures and loaded rooms of a snapshot
+        against the API in a background thread, then save the snapshot.
+        Return the thread, which is started once."""
+        if self._reconciler is None:
+            self._reconciler = threading.Thread(
+                target=self._reconcile_snapshot,
+                name="google-sdm-reconcile",
+                daemon=True,
             )
+            self._reconciler.start()
+        return self._reconciler
+
+    def _reconcile_snapshot(self):
+        try:
+            self.get_devices(refresh=True)
+            for structure in self.get_structures(refresh=True):
+                if structure._rooms is not None:
+                    structure.get_rooms(refresh=True)
+            if self.snapshot_path is not None:
+                self.save_snapshot()
+        except Exception as e:
+            LOGGER.error(f"Snapshot reconcile failed: {e}")
+
+    def token_expired(self, token) -> bool:
+        """Check if the token is expired, or expires within the margin of
+        the token manager, see `SDMTokenManager.expired`."""
+        return self.token_manager.expired(token)
 
     def refresh_tokens(self) -> Dict[str, Union[str, int]]:
-        """Refresh and return new tokens."""
+        """Refresh and return new tokens. Requests refresh through
+        `token_manager`, which makes concurrent refreshes share one call."""
         LOGGER.info("Refreshing tokens ...")
-        token = self._oauth.refresh_token(OAUTH2_TOKEN)
+        if self.tracer is not None:
+            with traced(self.tracer, "sdm.token_refresh"):
+                return self._refresh_tokens_observed()
+        return self._refresh_tokens_observed()
+
+    def _refresh_tokens_observed(self):
+        metrics = self.metrics
+        started = time.perf_counter()
+        try:
+            token = self._oauth.refresh_token(self.token_url)
+        except Exception:
+            if metrics.enabled:
+                metrics.observe_token_refresh(
+                    "error", time.perf_counter() - started
+                )
+            raise
+        if metrics.enabled:
+            metrics.observe_token_refresh("ok", time.perf_counter() - started)
 
         if self.token_updater is not None:
             self.token_updater(token)
 
         return token
 
-    def _request(self, method: str, path: str, **kwargs) -> Response:
-        """Make a request.
+    def _request_attributes(self, method, path):
+        return {
+            "http.method": method.upper(),
+            "sdm.endpoint": endpoint_label(path),
+        }
+
+    def _request(self, method: str, path: str, **kwargs) -> "Response":
+        """Make a request within the quota of `rate_limiter`, retrying
+        throttled and failed responses it allows to retry."""
+        if self.tracer is None:
+            return self._request_attempts(method, path, **kwargs)
+        with traced(
+            self.tracer, "sdm.request", self._request_attributes(method, path)
+        ) as span:
+            res = self._request_attempts(method, path, **kwargs)
+            span.set_attribute("http.status_code", res.status_code)
+            return res
+
+    def _request_attempts(self, method, path, **kwargs):
+        url = f"{self.api_url}{path}"
+        metrics = self.metrics
+        attempt = 0
+        while True:
+            delay = self.rate_limiter.acquire(path)
+            if delay > 0:
+                time.sleep(delay)
+            if metrics.enabled or self.tracer is not None:
+                res = self._send_observed(method, path, url, **kwargs)
+            else:
+                res = self._send(method, url, **kwargs)
+            delay = self.rate_limiter.retry_delay(
+                res.status_code, res.headers, attempt
+            )
+            if delay is None:
+                return res
+            LOGGER.warning(
+                f"Request: {method} {url} returned {res.status_code}, "
+                + f"retrying in {delay:.2f}s"
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def _send_observed(self, method, path, url, **kwargs) -> "Response":
+        """`_send`, recorded in `metrics` and traced by `tracer`."""
+        started = time.perf_counter()
+        status = "error"
+        try:
+            if self.tracer is None:
+                res = self._send(method, url, **kwargs)
+            else:
+                with traced(self.tracer, "sdm.http", {"http.url": url}) \
+                        as span:
+                    res = self._send(method, url, **kwargs)
+                    span.set_attribute("http.status_code", res.status_code)
+            status = str(res.status_code)
+            return res
+        finally:
+            if self.metrics.enabled:
+                self.metrics.observe_request(
+                    endpoint_label(path), method, status,
+                    time.perf_counter() - started,
+                )
+
+    def _send(self, method: str, url: str, **kwargs) -> "Response":
+        """Send a single request.
         We don't use the built-in token refresh mechanism of OAuth2 session
         because we want to allow overriding the token refresh logic.
         """
-        url = f"{API_URL}{path}"
         LOGGER.debug(f"Request: {method} {url}")
+        from oauthlib.oauth2 import TokenExpiredError
 
+        token = self._oauth.token
         try:
-            return getattr(self._oauth, method)(url, **kwargs)
+            res = getattr(self._oauth, method)(url, **kwargs)
         except TokenExpiredError:
             LOGGER.warning("Token expired.")
-            self._oauth.token = self.refresh_tokens()
+            self.token_manager.refresh(token)
 
             return getattr(self._oauth, method)(url, **kwargs)
+        if res.status_code == 401:
+            # Rejected before its expiry, e.g. revoked
+            LOGGER.warning("Token rejected.")
+            self.token_manager.refresh(token)
 
-    def _get(self, endpoint):
-        """Get data as dictionary from an endpoint."""
-        res = self._request("get", endpoint)
-        if not res.content:
+            return getattr(self._oauth, method)(url, **kwargs)
+        return res
+
+    def _decode(self, content):
+        """Decode a response body as dictionary."""
+        if not content:
             return {}
         try:
-            res = res.json()
-        except json.JSONDecodeError:
-            raise ValueError("Cannot parse {} as JSON".format(res))
+            return self.codec.loads(content)
+        except ValueError:
+            raise ValueError("Cannot parse {} as JSON".format(content))
+
+    @staticmethod
+    def _check_get(res):
         if "error" in res:
             raise SDMError(res["error"])
         return res
 
-    def _post(self, endpoint, data):
-        """Get data as dictionary from an endpoint."""
-        res = self._request("post", endpoint, data=json.dumps(data))
-        if not res.content:
-            return {}
-        try:
-            res = res.json()
-        except json.JSONDecodeError:
-            raise ValueError("Cannot parse {} as JSON".format(res))
+    @staticmethod
+    def _check_post(res):
         if "error" in res:
             if "code" in res['error'] and res['error']['code'] == 401:
+                from oauthlib.oauth2 import TokenExpiredError
                 raise TokenExpiredError()
             else:
                 raise SDMError(res["error"])
         return res
 
+    def _cache_before(self, endpoint):
+        """Return the cached body of an endpoint if it is fresh, else None
+        and the arguments of a (conditional) request for it."""
+        if self.cache is None:
+            return None, {}
+        entry = self.cache.lookup(endpoint)
+        if entry is None:
+            return None, {}
+        if entry.expires > time.monotonic():
+            return entry.content, {}
+        if entry.etag is None:
+            return None, {}
+        return None, {"headers": {"If-None-Match": entry.etag}}
+
+    def _cache_after(self, endpoint, res):
+        """Return the body of a response, caching it or, for a 304,
+        returning the cached one."""
+        if self.cache is None:
+            return res.content
+        if res.status_code == 304:
+            content = self.cache.revalidate(endpoint)
+            if content is not None:
+                return content
+        if res.status_code == 200:
+            self.cache.store(endpoint, res.content, res.headers.get("ETag"))
+        return res.content
+
+    def _cache_invalidate(self, endpoint):
+        """Drop the cached reads a command to `endpoint` may change."""
+        if self.cache is not None:
+            device = device_of(endpoint)
+            if device is not None:
+                self.cache.invalidate_device(device)
+
+    def _get(self, endpoint):
+        """Get data as dictionary from an endpoint."""
+        content, kwargs = self._cache_before(endpoint)
+        if content is None:
+            res = self._request("get", endpoint, **kwargs)
+            content = self._cache_after(endpoint, res)
+        return self._check_get(self._decode(content))
+
+    def _observe_command(self, data, status, started):
+        """Record a command in `metrics`."""
+        if "command" in data:
+            self.metrics.observe_command(
+                command_label(data["command"]), status,
+                time.perf_counter() - started,
+            )
+
+    def _post_span(self, endpoint, data):
+        """Return the name and attributes of the span of a post."""
+        if "command" not in data:
+            return "sdm.post", {"sdm.endpoint": endpoint_label(endpoint)}
+        return "sdm.execute_command", {
+            "sdm.command": command_label(data["command"]),
+            "sdm.device": device_of(endpoint) or "",
+        }
+
+    def _post(self, endpoint, data):
+        """Post data (as json) to an endpoint."""
+        if self.tracer is None:
+            return self._post_observed(endpoint, data)
+        with traced(self.tracer, *self._post_span(endpoint, data)):
+            return self._post_observed(endpoint, data)
+
+    def _post_observed(self, endpoint, data):
+        started = time.perf_counter() if self.metrics.enabled else None
+        try:
+            res = self._request("post", endpoint, data=self.codec.dumps(data))
+        except Exception:
+            if started is not None:
+                self._observe_command(data, "error", started)
+            raise
+        if started is not None:
+            self._observe_command(data, str(res.status_code), started)
+        self._cache_invalidate(endpoint)
+        return self._check_post(self._decode(res.content))
+
+    def register_device_listener(self, device_listener):
+        """Register a callable invoked with the lists of added and removed
+        `SDMDevice` instances whenever a refresh changes the set of
+        devices."""
+        self._device_listeners.append(device_listener)
+
+    def _load_devices(self, data):
+        """Reconcile the known devices with a fresh listing: existing
+        devices are updated in place, keeping their listeners, new ones are
+        added and missing ones are retired."""
+        seen = set()
+        added = []
+        removed = []
+        moved = []
+        with self._devices.lock:
+            for resource in data.get("devices", []):
+                if resource["type"] not in self.DEVICE_TYPES:
+                    continue
+                seen.add(resource["name"])
+                device = self._devices.get(resource["name"])
+                if device is not None and device.type == resource["type"]:
+                    relations = device.parentRelations
+                    if device._reconcile(**resource) \
+                            and device.parentRelations != relations:
+                        moved.append((device, relations))
+                    continue
+                if device is not None:
+                    removed.append(device)
+                added.append(
+                    self.DEVICE_TYPES[resource["type"]](self, **resource)
+                )
+            for device in self._devices.list():
+                if device.name not in seen:
+                    removed.append(device)
+            # One copy of the registry for the whole listing
+            if added or removed or moved:
+                self._devices.update(
+                    add=added,
+                    remove=[device.name for device in removed],
+                    moved=moved,
+                )
+        for device in removed:
+            LOGGER.debug(f"Device removed: {device.name}")
+            device._retire()
+        if added or removed:
+            for device_listener in self._device_listeners:
+                device_listener(added, removed)
+
+    def _load_structures(self, data):
+        """Reconcile the known structures with a fresh listing."""
+        structures = []
+        with self._structures.lock:
+            for resource in data.get("structures", []):
+                structure = self._structures.get(resource["name"])
+                if structure is None:
+                    structure = self.STRUCTURE_TYPE(self, **resource)
+                else:
+                    structure._reconcile(**resource)
+                structures.append(structure)
+            self._structures.replace(structures)
+
     def get_devices(self, refresh=False) -> List[SDMDevice]:
         """Return a list of `SDMDevice` instances for all
         devices."""
         if not self._devices or refresh:
-            data = self._get(ENDPOINT_DEVICES.format(self.project_id))
-            for device in data["devices"]:
-                if device["type"] in self.DEVICE_TYPES:
-                    self._devices.append(
-                        self.DEVICE_TYPES[device["type"]](self, **device)
-                    )
-        return self._devices
+            self._load_devices(
+                self._get(ENDPOINT_DEVICES.format(self.project_id))
+            )
+        return self._devices.list()
+
+    def get_device(self, name) -> Optional[SDMDevice]:
+        """Return the `SDMDevice` with the given name, or None."""
+        if not self._devices:
+            self.get_devices()
+        return self._devices.get(name)
+
+    def get_devices_by_type(self, device_type) -> List[SDMDevice]:
+        """Return the `SDMDevice` instances of a type, e.g.
+        `SDMThermostat.STR_REPR`."""
+        if not self._devices:
+            self.get_devices()
+        return self._devices.by_type(device_type)
+
+    def get_devices_by_structure(self, structure) -> List[SDMDevice]:
+        """Return the `SDMDevice` instances in a structure, given either
+        the `SDMStructure` or its name."""
+        if not self._devices:
+            self.get_devices()
+        return self._devices.by_structure(
+            getattr(structure, "name", structure)
+        )
+
+    def get_devices_by_room(self, room) -> List[SDMDevice]:
+        """Return the `SDMDevice` instances in a room, given either the
+        `SDMStructure.Room` or its name."""
+        if not self._devices:
+            self.get_devices()
+        return self._devices.by_room(getattr(room, "name", room))
 
     def get_structures(self, refresh=False) -> List[SDMStructure]:
         """Return a list of `SDMStructure` instances for all
         structures."""
         if not self._structures or refresh:
-            data = self._get(ENDPOINT_STRUCTURES.format(self.project_id))
-            for structure in data["structures"]:
-                self._structures.append(
-                    SDMStructure(self, **structure)
-                )
-        return self._structures
+            self._load_structures(
+                self._get(ENDPOINT_STRUCTURES.format(self.project_id))
+            )
+        return self._structures.list()
+
+    def _command_executor(self):
+        if self._command_pool is None:
+            self._command_pool = ThreadPoolExecutor(
+                max_workers=self.max_command_workers,
+                thread_name_prefix="google-sdm-command",
+            )
+        return self._command_pool
+
+    def execute_many(self, commands, max_concurrency=None) \
+            -> List[SDMCommandResult]:
+        """Execute `(device, command, params)` tuples concurrently on the
+        command worker pool and return their `SDMCommandResult`s in the
+        order of `commands`. Errors are returned, not raised.
+
+        Commands held by the `coalescer` are waited for, blocking or not:
+        their result, or error, is that of the command sent in their
+        place."""
+        results = list(
+            self.execute_many_as_completed(commands, max_concurrency)
+        )
+        results.sort(key=lambda result: result.index)
+        return results
+
+    def execute_many_as_completed(self, commands, max_concurrency=None):
+        """Like `execute_many`, but yield the `SDMCommandResult`s as the
+        commands complete. At most `max_concurrency` commands (default:
+        `max_command_workers`) are in flight at once."""
+        return execute_as_completed(
+            self._command_executor(),
+            commands,
+            max_concurrency or self.max_command_workers,
+        )
+
+    def _execute_command(self, device, command, params):
+        """Send a command to a device and, if `optimistic`, apply its
+        declared effect to the device traits once it succeeded."""
+        sent_ns = time.time_ns()
+        result = device._post(
+            ":executeCommand",
+            {"command": command, "params": params},
+        )
+        if self.optimistic:
+            device._apply_effect(command, params, sent_ns)
+        return result
+
+    def _coalesce(self, coalescer, device, command, params):
+        """Hold a command in `coalescer` and return its result, or its
+        future unless the coalescer blocks."""
+        future, first = coalescer.submit(device, command, params)
+        if first:
+            self._schedule_coalesced(coalescer, device.name, coalescer.window)
+        return future.result() if coalescer.block else future
+
+    def _schedule_coalesced(self, coalescer, name, delay):
+        timer = threading.Timer(
+            delay, self._flush_coalesced, (coalescer, name)
+        )
+        timer.daemon = True
+        timer.start()
+
+    def _flush_coalesced(self, coalescer, name):
+        """Send the burst of a device once due, or wait for it to be."""
+        delay = coalescer.remaining(name)
+        if delay > 0:
+            self._schedule_coalesced(coalescer, name, delay)
+            return
+        self._send_coalesced(*coalescer.take(name))
+
+    def _send_coalesced(self, device, commands):
+        """Send the commands of a coalesced burst and resolve their
+        callers."""
+        for command, params, futures in commands:
+            try:
+                result = device._execute_now(command, params)
+            except Exception as e:
+                resolve(futures, error=e)
+            else:
+                resolve(futures, result)
+
+    def flush_commands(self):
+        """Send the commands held by `coalescer` without waiting for their
+        window to close."""
+        if self.coalescer is not None:
+            for name in self.coalescer.pending():
+                self._send_coalesced(*self.coalescer.take(name))
+
+    def close(self):
+        """Send the held commands, release the command worker pool, stop
+        the proactive token refresh and save the snapshot, if enabled."""
+        self.flush_commands()
+        self.token_manager.stop()
+        if self._command_pool is not None:
+            self._command_pool.shutdown()
+            self._command_pool = None
+        if self.snapshot_path is not None and self._devices:
+            self.save_snapshot()
 
     def get_authurl(self):
         """Get the URL needed for the authorization code grant flow."""
@@ -250,9 +884,14 @@ class SDM(SDMAPI):
                  redirect_uri="",
                  pubsub_subscription="",
                  pubsub_auth_path="",
-                 token_cache=None):
-        """Initialize the connection."""
+                 token_cache=None,
+                 state_cache=None,
+                 **kwargs):
+        """Initialize the connection. `state_cache`, if given, is the
+        snapshot file devices and structures are warm-started from. Extra
+        keyword arguments are passed to `SDMAPI`."""
         self.token_cache = token_cache or "google-sdm_oauth_token.json"
+        kwargs.setdefault("snapshot_path", state_cache)
 
         super().__init__(
             self.token_load(),
@@ -262,13 +901,13 @@ class SDM(SDMAPI):
             redirect_uri,
             pubsub_subscription,
             pubsub_auth_path,
-            self.token_dump
+            token_updater=self.token_dump,
+            **kwargs
         )
 
     def token_dump(self, token):
-        """Dump the token to a JSON file."""
-        with open(self.token_cache, "w") as f:
-            json.dump(token, f)
+        """Dump the token to a JSON file, atomically."""
+        atomic_write(self.token_cache, json.dumps(token).encode())
 
     def token_load(self):
         """Load the token from the cache if exists it and is not expired,
@@ -281,18 +920,14 @@ class SDM(SDMAPI):
         token["expires_in"] = token.get("expires_at", now - 1) - now
         return token
 
-    def token_expired(self, token):
-        """Check if the token is expired."""
-        now = int(time.time())
-        return token["expires_at"] - now < 60
-
     def get_token(self, authorization_response):
         """Get the token given the redirect URL obtained from the
         authorization."""
         LOGGER.info("Fetching token ...")
         token = self._oauth.fetch_token(
-            OAUTH2_TOKEN,
+            self.token_url,
             authorization_response=authorization_response,
             client_secret=self.client_secret,
         )
+        self.token_manager.notify()
         self.token_dump(token)
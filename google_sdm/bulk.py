@@ -0,0 +1,59 @@
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+SDMCommandResult = namedtuple(
+    "SDMCommandResult",
+    ["index", "device", "command", "params", "result", "error"],
+)
+SDMCommandResult.__doc__ = """Outcome of one command of a bulk execution.
+`error` is the raised exception, in which case `result` is None."""
+
+
+def _run(index, device, command, params):
+    try:
+        result = device.execute_command(command, params)
+        if isinstance(result, Future):
+            # Held by a non-blocking coalescer: wait for the command sent
+            result = result.result()
+    except Exception as e:
+        return SDMCommandResult(index, device, command, params, None, e)
+    return SDMCommandResult(index, device, command, params, result, None)
+
+
+def execute_as_completed(executor, commands, max_concurrency):
+    """Run `(device, command, params)` tuples on `executor`, keeping at
+    most `max_concurrency` in flight, and yield `SDMCommandResult`s as
+    they complete."""
+    pending = set()
+    for index, (device, command, params) in enumerate(commands):
+        if len(pending) >= max_concurrency:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(_run, index, device, command, params))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+async def _run_async(semaphore, index, device, command, params):
+    async with semaphore:
+        try:
+            result = await device.execute_command(command, params)
+        except Exception as e:
+            return SDMCommandResult(index, device, command, params, None, e)
+        return SDMCommandResult(index, device, command, params, result, None)
+
+
+def execute_as_completed_async(commands, max_concurrency):
+    """Schedule `(device, command, params)` tuples on the running loop,
+    keeping at most `max_concurrency` in flight, and return an iterator of
+    awaitables of `SDMCommandResult` in completion order."""
+    import asyncio
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return asyncio.as_completed([
+        _run_async(semaphore, index, device, command, params)
+        for index, (device, command, params) in enumerate(commands)
+    ])
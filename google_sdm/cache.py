@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict, Optional
+
+DEFAULT_TTLS = {
+    "devices": 30.0,
+    "structures": 300.0,
+    "rooms": 300.0,
+}
+
+CacheEntry = namedtuple("CacheEntry", ["content", "etag", "expires"])
+
+
+def endpoint_kind(endpoint: str) -> Optional[str]:
+    """Classify an endpoint as `devices`, `structures` or `rooms`, be it
+    a collection or a single resource."""
+    parts = endpoint.split(":", 1)[0].split("/")
+    for kind in ("rooms", "devices", "structures"):
+        if parts[-1] == kind or (len(parts) > 1 and parts[-2] == kind):
+            return kind
+    return None
+
+
+class SDMResponseCache:
+    """LRU cache of raw `SDMAPI._get` response bodies.
+
+    Entries live for the TTL of their endpoint kind (see `DEFAULT_TTLS`).
+    Expired entries with an `ETag` are kept so the next read can be a
+    conditional request, which the server may answer with a 304. Bodies
+    are stored undecoded, so every hit hands out fresh objects that callers
+    may mutate.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = 60.0,
+    ):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidations": 0,
+            "invalidations": 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl(self, endpoint: str) -> float:
+        return self.ttls.get(endpoint_kind(endpoint), self.default_ttl)
+
+    def lookup(self, endpoint: str) -> Optional[CacheEntry]:
+        """Return the entry of an endpoint, fresh or not."""
+        with self._lock:
+            entry = self._entries.get(endpoint)
+            if entry is None or entry.expires <= time.monotonic():
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                self._entries.move_to_end(endpoint)
+            return entry
+
+    def store(self, endpoint: str, content: bytes, etag=None):
+        expires = time.monotonic() + self.ttl(endpoint)
+        with self._lock:
+            self._entries[endpoint] = CacheEntry(content, etag, expires)
+            self._entries.move_to_end(endpoint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def revalidate(self, endpoint: str) -> Optional[bytes]:
+        """Renew an entry the server reported as not modified and return its
+        content."""
+        with self._lock:
+            entry = self._entries.get(endpoint)
+            if entry is None:
+                return None
+            self._entries[endpoint] = entry._replace(
+                expires=time.monotonic() + self.ttl(endpoint)
+            )
+            self._entries.move_to_end(endpoint)
+            self._stats["revalidations"] += 1
+            return entry.content
+
+    def invalidate(self, prefix: str = ""):
+        """Drop the entries of the endpoint `prefix` and of the endpoints
+        below it; everything by default."""
+        with self._lock:
+            stale = [
+                endpoint for endpoint in self._entries
+                if not prefix or endpoint.startswith(prefix)
+                and endpoint[len(prefix):len(prefix) + 1] in ("", "/", ":")
+            ]
+            for endpoint in stale:
+                del self._entries[endpoint]
+            self._stats["invalidations"] += len(stale)
+
+    def invalidate_device(self, name: str):
+        """Drop the entries of a device and of the device listing it
+        appears in."""
+        with self._lock:
+            for endpoint in (name, name.rsplit("/", 1)[0]):
+                if self._entries.pop(endpoint, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
@@ -0,0 +1,170 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from .traits import (
+    ThermostatEcoTrait,
+    ThermostatModeTrait,
+    ThermostatTemperatureSetpointTrait,
+)
+
+_SETPOINT = ThermostatTemperatureSetpointTrait.COMMANDS
+
+# Setpoint command sending exactly the given setpoint parameters
+_SETPOINT_COMMANDS = {
+    frozenset(["heatCelsius"]): _SETPOINT["SetHeat"],
+    frozenset(["coolCelsius"]): _SETPOINT["SetCool"],
+    frozenset(["heatCelsius", "coolCelsius"]): _SETPOINT["SetRange"],
+}
+
+SETPOINT_FAMILY = "setpoint"
+
+# Command families coalesced by default, by command
+DEFAULT_FAMILIES = {
+    _SETPOINT["SetHeat"]: SETPOINT_FAMILY,
+    _SETPOINT["SetCool"]: SETPOINT_FAMILY,
+    _SETPOINT["SetRange"]: SETPOINT_FAMILY,
+    ThermostatModeTrait.COMMANDS["SetMode"]: "mode",
+    ThermostatEcoTrait.COMMANDS["SetMode"]: "eco",
+}
+
+
+class _Batch:
+
+    __slots__ = ("device", "first", "last", "commands")
+
+    def __init__(self, device, now):
+        self.device = device
+        self.first = now
+        self.last = now
+        # Family: [command, params, futures], in order of first submission
+        self.commands = {}
+
+
+class SDMCommandCoalescer:
+    """Coalesce bursts of commands to the same device, e.g. from a UI
+    slider, into one `:executeCommand` per command family.
+
+    Once installed as `SDMAPI.coalescer`, the commands of `families` are
+    held until no other command came for the device in `window` seconds,
+    but no longer than `max_delay` seconds after the first one. Only the
+    last command of each family is then sent; with `merge_setpoints`, the
+    `SetHeat`, `SetCool` and `SetRange` setpoints of the burst are merged
+    into a single command instead, e.g. `SetHeat` and `SetCool` into one
+    `SetRange`. Every caller of the burst receives the result, or the
+    error, of the command sent in its place. Families are sent in the
+    order they first appeared in the burst, one after the other.
+
+    With `block`, the synchronous `execute_command` waits for that result,
+    so only commands issued from different threads coalesce; without it,
+    it returns a `concurrent.futures.Future` right away. The asyncio
+    client always returns an awaitable.
+    """
+
+    def __init__(
+        self,
+        window: float = 0.5,
+        max_delay: Optional[float] = 2.0,
+        families: Optional[Dict[str, str]] = None,
+        merge_setpoints: bool = True,
+        block: bool = True,
+    ):
+        self.window = window
+        self.max_delay = max_delay
+        self.families = dict(DEFAULT_FAMILIES if families is None
+                             else families)
+        if not merge_setpoints:
+            # Each setpoint command only supersedes itself
+            for command, family in self.families.items():
+                if family == SETPOINT_FAMILY:
+                    self.families[command] = command
+        self.block = block
+        self._lock = threading.Lock()
+        self._batches = {}
+        self._stats = {"commands": 0, "sent": 0, "superseded": 0}
+
+    def coalesces(self, command: str) -> bool:
+        """Return whether `command` is held for coalescing."""
+        return command in self.families
+
+    def submit(self, device, command: str, params: Dict) \
+            -> Tuple[Future, bool]:
+        """Hold a command and return the future of its result, and whether
+        it started a burst, in which case the caller schedules `flush`
+        after `window` seconds."""
+        family = self.families[command]
+        future = Future()
+        with self._lock:
+            self._stats["commands"] += 1
+            now = time.monotonic()
+            batch = self._batches.get(device.name)
+            first = batch is None
+            if first:
+                batch = self._batches[device.name] = _Batch(device, now)
+            batch.last = now
+            held = batch.commands.get(family)
+            if held is None:
+                batch.commands[family] = [command, params, [future]]
+            else:
+                self._stats["superseded"] += 1
+                held[0], held[1] = self.merge(
+                    family, held[0], held[1], command, params
+                )
+                held[2].append(future)
+        return future, first
+
+    def merge(self, family: str, command: str, params: Dict,
+              new_command: str, new_params: Dict) -> Tuple[str, Dict]:
+        """Return the command and parameters replacing a held command of
+        `family` followed by `new_command`. The last command wins, but
+        setpoints are merged."""
+        if family != SETPOINT_FAMILY:
+            return new_command, new_params
+        params = dict(params, **new_params)
+        return _SETPOINT_COMMANDS[frozenset(params)], params
+
+    def remaining(self, name: str) -> float:
+        """Return the seconds left before the burst of the device `name`
+        is due, 0 if it is due or there is none."""
+        with self._lock:
+            batch = self._batches.get(name)
+            if batch is None:
+                return 0.0
+            due = batch.last + self.window
+            if self.max_delay is not None:
+                due = min(due, batch.first + self.max_delay)
+        return max(0.0, due - time.monotonic())
+
+    def take(self, name: str) -> Tuple[Optional[object], List]:
+        """Remove the burst of the device `name` and return the device and
+        the `(command, params, futures)` to send for it."""
+        with self._lock:
+            batch = self._batches.pop(name, None)
+            if batch is None:
+                return None, []
+            self._stats["sent"] += len(batch.commands)
+        return batch.device, [
+            tuple(held) for held in batch.commands.values()
+        ]
+
+    def pending(self) -> List[str]:
+        """Return the names of the devices with held commands."""
+        with self._lock:
+            return list(self._batches)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the commands submitted, sent, and superseded by a later
+        command of their burst."""
+        with self._lock:
+            return dict(self._stats)
+
+
+def resolve(futures: List[Future], result=None,
+            error: Optional[BaseException] = None):
+    """Complete the futures of the callers of a coalesced command."""
+    for future in futures:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
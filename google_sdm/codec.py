@@ -0,0 +1,42 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class SDMCodec:
+    """JSON codec used for API responses, commands and Pub/Sub messages.
+    Decoding takes the raw `bytes` and errors are `ValueError`s."""
+
+    name = "json"
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+
+class SDMOrjsonCodec(SDMCodec):
+    """`SDMCodec` backed by orjson."""
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("SDMOrjsonCodec requires the orjson package")
+
+    def loads(self, data: bytes):
+        return orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj)
+
+
+def default_codec() -> SDMCodec:
+    """Return the fastest codec installed."""
+    if orjson is not None:
+        return SDMOrjsonCodec()
+    return SDMCodec()
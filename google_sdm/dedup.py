@@ -0,0 +1,65 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# SDM events start with their eventId, which lets it be read without
+# decoding the message.
+_LEADING_EVENT_ID = re.compile(rb'\s*\{\s*"eventId"\s*:\s*"([^"\\]+)"')
+
+
+def peek_event_id(data: bytes) -> Optional[str]:
+    """Return the `eventId` of a raw SDM event if it leads the message,
+    else None."""
+    match = _LEADING_EVENT_ID.match(data)
+    if match is None:
+        return None
+    return match.group(1).decode()
+
+
+class SDMEventDeduplicator:
+    """Bounded, time windowed LRU of the event ids being or already
+    processed, to drop Pub/Sub redeliveries.
+
+    An id is remembered for `window` seconds, and at most `max_size` ids
+    are kept. Ids of events that failed must be `forget`-ed so their
+    redelivery is processed.
+
+    `SDMAPI` uses one by default; pass `deduplicator=False` to process
+    every delivery.
+    """
+
+    def __init__(self, max_size: int = 10000, window: float = 600.0):
+        self.max_size = max_size
+        self.window = window
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def seen(self, event_id: str) -> bool:
+        """Return whether an event id was seen within the window, and
+        remember it."""
+        now = time.monotonic()
+        with self._lock:
+            seen = self._seen
+            while seen:
+                oldest, stamp = next(iter(seen.items()))
+                if now - stamp < self.window and len(seen) < self.max_size:
+                    break
+                del seen[oldest]
+            if event_id in seen:
+                self._stats["hits"] += 1
+                return True
+            seen[event_id] = now
+            self._stats["misses"] += 1
+            return False
+
+    def forget(self, event_id: str):
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the duplicate hits, the misses and the ids held."""
+        with self._lock:
+            return dict(self._stats, size=len(self._seen))
@@ -1,12 +1,40 @@
+import threading
+import time
 from abc import ABC
-from datetime import timezone, datetime
+from datetime import datetime
 
+from ..tracing import traced
 from ..traits import SDMTraitGetter, DeviceInfoTrait
-from ..utils import deep_merge
+from ..traits.trait import command_effect
+from ..utils import (
+    EPOCH,
+    deep_merge_copy,
+    parse_timestamp_ns,
+    timestamp_from_ns,
+)
+
+
+def _field_key(field):
+    """Return the listener index key of a `"<trait name>.<field path>"`,
+    e.g. `("sdm.devices.traits.Fan", "timerMode")`."""
+    prefix, sep, path = field.partition(".traits.")
+    name, *names = path.split(".")
+    if not sep or not name or not names or not all(names):
+        raise ValueError(f"Not a trait field path: {field!r}")
+    return (f"{prefix}{sep}{name}", *names)
 
 
 class SDMDevice(ABC):
-    """Class representing a single SDM device."""
+    """Class representing a single SDM device.
+
+    `traits` is never modified in place: updates, serialized per device,
+    publish a merged copy sharing the unchanged trait dictionaries, so a
+    reader holding `traits` sees either the previous or the next state.
+
+    Once a command succeeds, the trait fields its `Trait.EFFECTS` declare
+    are set right away. They stay pending until an event timestamped at or
+    after the command was sent sets them; older events don't revert them.
+    """
 
     def __init__(
         self,
@@ -26,9 +54,19 @@ class SDMDevice(ABC):
         self.name = name or ""
         self.connected = connected
         self.status = {}
-        self.last_updated = datetime.now(tz=timezone.utc)
+        self.last_updated_ns = time.time_ns()
         self._update_listeners = []
+        self._filtered_listeners = {}
+        # Changed path: its filtered listeners, by registration order
+        self._listener_routes = {}
+        self._listener_seq = 0
+        self._last_changes = []
         self._event_listeners = []
+        self._removal_listeners = []
+        self._trait_cache = {}
+        self._write_lock = threading.Lock()
+        # (trait name, field): when the command setting it was sent, in ns
+        self._pending_effects = {}
 
     def __repr__(self):
         rep = "SDMDevice("
@@ -45,6 +83,21 @@ class SDMDevice(ABC):
             self.connected,
         )
 
+    @property
+    def last_updated(self) -> datetime:
+        """Time of the last applied event. Events are ordered on
+        `last_updated_ns`, nanoseconds since the epoch, so the `datetime` is
+        only built when asked for."""
+        return timestamp_from_ns(self.last_updated_ns)
+
+    @last_updated.setter
+    def last_updated(self, value: datetime):
+        delta = value - EPOCH
+        self.last_updated_ns = (
+            (delta.days * 86400 + delta.seconds) * 1000000
+            + delta.microseconds
+        ) * 1000
+
     def _get(self, endpoint):
         """Get data (as dictionary) from an endpoint."""
         return self.api._get(f"{self.name}{endpoint}")
@@ -54,18 +107,200 @@ class SDMDevice(ABC):
         return self.api._post(f"{self.name}{endpoint}", data)
 
     def execute_command(self, command, params):
-        """Uses the :executeCommand endpoint."""
-        return self._post(
-            ":executeCommand",
-            {"command": command, "params": params},
-        )
+        """Uses the :executeCommand endpoint. Commands coalesced by the
+        `coalescer` of the API are held and may be merged with later ones,
+        see `SDMCommandCoalescer`."""
+        coalescer = self.api.coalescer
+        if coalescer is not None and coalescer.coalesces(command):
+            return self.api._coalesce(coalescer, self, command, params)
+        return self._execute_now(command, params)
+
+    def _execute_now(self, command, params):
+        """Send a command, bypassing the coalescer."""
+        return self.api._execute_command(self, command, params)
+
+    def _apply_effect(self, command, params, sent_ns):
+        """Set the trait fields of the declared effect of a successful
+        command sent at `sent_ns`, and call the listeners if they
+        changed."""
+        effect = command_effect(command)
+        if effect is None:
+            return
+        trait, effect = effect
+        values = effect(params)
+        with self._write_lock:
+            if not values or trait not in self.traits:
+                return
+            if self.last_updated_ns >= sent_ns:
+                # An event as recent as the command already came in and
+                # may carry its effect, or a later change
+                return
+            traits, changes = deep_merge_copy(self.traits, {trait: values})
+            self.traits = traits
+            self._last_changes = changes
+            pending = self._pending_effects
+            for field in values:
+                pending[trait, field] = max(
+                    sent_ns, pending.get((trait, field), sent_ns)
+                )
+            if changes:
+                self._invalidate_traits({trait})
+        if changes:
+            self._notify_update({trait: values}, changes)
+
+    def _settle_effects(self, traits, timestamp):
+        """Return a trait update without the pending fields it predates,
+        and drop the pending fields it sets as of a later time."""
+        stale = {}
+        for key, sent_ns in list(self._pending_effects.items()):
+            trait, field = key
+            if field not in traits.get(trait, ()):
+                continue
+            if timestamp >= sent_ns:
+                del self._pending_effects[key]
+            else:
+                stale.setdefault(trait, set()).add(field)
+        if not stale:
+            return traits
+        traits = dict(traits)
+        for trait, fields in stale.items():
+            values = {
+                field: value for field, value in traits[trait].items()
+                if field not in fields
+            }
+            if values:
+                traits[trait] = values
+            else:
+                del traits[trait]
+        return traits
+
+    def register_update_listener(self, update_listener, traits=None,
+                                 fields=None):
+        """Register a callable invoked with the traits of each update.
 
-    def register_update_listener(self, update_listener):
-        self._update_listeners.append(update_listener)
+        With `traits` (trait names or `Trait` classes) or `fields`
+        (`"<trait name>.<field>"` paths, possibly nested, e.g.
+        `sdm.devices.traits.CameraLiveStream.maxVideoResolution.width`),
+        it is only invoked when one of them, or a value nested in one of
+        them, changed, after the unfiltered listeners and in registration
+        order. A malformed field path raises a `ValueError`.
+        """
+        if traits is None and fields is None:
+            self._update_listeners.append(update_listener)
+            return
+        keys = [getattr(trait, "NAME", trait) for trait in traits or ()]
+        keys += [_field_key(field) for field in fields or ()]
+        self._listener_seq += 1
+        entry = (self._listener_seq, update_listener)
+        index = self._filtered_listeners
+        for key in keys:
+            index.setdefault(key, []).append(entry)
+        self._listener_routes = {}
+
+    def _route(self, change):
+        """Return the filtered update listeners of a changed path, by
+        registration sequence, those of its trait and of its prefixes."""
+        routes = self._listener_routes
+        route = routes.get(change)
+        if route is None:
+            index = self._filtered_listeners
+            keys = [change[0]]
+            keys += [change[:end] for end in range(2, len(change) + 1)]
+            selected = {}
+            for key in keys:
+                for seq, listener in index.get(key, ()):
+                    selected[seq] = listener
+            route = routes[change] = {
+                seq: selected[seq] for seq in sorted(selected)
+            }
+        return route
+
+    def _affected_listeners(self, changes):
+        """Return the filtered update listeners of the changed paths."""
+        if len(changes) == 1:
+            return self._route(changes[0]).values()
+        selected = {}
+        for change in changes:
+            selected.update(self._route(change))
+        return [selected[seq] for seq in sorted(selected)]
+
+    @property
+    def last_changes(self):
+        """Dotted paths of the values changed by the last trait update, e.g.
+        `sdm.devices.traits.Temperature.ambientTemperatureCelsius`."""
+        return [".".join(change) for change in self._last_changes]
 
     def register_event_listener(self, event_listener):
         self._event_listeners.append(event_listener)
 
+    def register_removal_listener(self, removal_listener):
+        self._removal_listeners.append(removal_listener)
+
+    def _reconcile(
+        self,
+        traits=None,
+        parentRelations=None,
+        assignee=None,
+        connected=False,
+        **kwargs
+    ):
+        """Update the device in place from a freshly fetched resource.
+        Return whether anything changed."""
+        changed = False
+        with self._write_lock:
+            # The listing is authoritative for the pending effects
+            self._pending_effects.clear()
+            if (traits or {}) != self.traits:
+                self.traits = traits or {}
+                self._invalidate_traits()
+                changed = True
+            if (parentRelations or [{}]) != self.parentRelations:
+                self.parentRelations = parentRelations or [{}]
+                changed = True
+            if (assignee or "") != self.assignee:
+                self.assignee = assignee or ""
+                changed = True
+            if connected != self.connected:
+                self.connected = connected
+                changed = True
+        return changed
+
+    def _snapshot(self):
+        """Return the device resource and `last_updated_ns`, for
+        `SDMAPI.save_snapshot`."""
+        return {
+            "resource": {
+                "name": self.name,
+                "type": self.type,
+                "assignee": self.assignee,
+                "traits": self.traits,
+                "parentRelations": self.parentRelations,
+                "connected": self.connected,
+            },
+            "last_updated_ns": self.last_updated_ns,
+        }
+
+    def _invalidate_traits(self, names=None):
+        """Drop the cached trait views, only those of the trait `names` if
+        given. Call it after publishing new `traits`.
+
+        The cache is replaced rather than modified: a reader still building
+        a view of the previous traits stores it in the dropped cache.
+        """
+        if names is None:
+            self._trait_cache = {}
+            return
+        cache = self._trait_cache.copy()
+        for trait_type in list(cache):
+            if trait_type.name() in names:
+                del cache[trait_type]
+        self._trait_cache = cache
+
+    def _retire(self):
+        """Notify the removal listeners that the device is gone."""
+        for removal_listener in self._removal_listeners:
+            removal_listener(self)
+
     @SDMTraitGetter(DeviceInfoTrait)
     def get_info(self, **kwargs):
         if "trait" not in kwargs:
@@ -73,23 +308,49 @@ class SDMDevice(ABC):
         return kwargs["trait"]
 
     def event_callback(self, message):
-        timestamp = datetime.strptime(
-            message["timestamp"],
-            '%Y-%m-%dT%H:%M:%S.%f%z'
-        )
-        if timestamp > self.last_updated:
-            self.last_updated = timestamp
-            if "events" in message["resourceUpdate"]:
-                for event_listener in self._event_listeners:
-                    event_listener(message["resourceUpdate"]["events"])
-            elif "traits" in message["resourceUpdate"]:
-                self.traits = deep_merge(
-                    self.traits,
-                    message["resourceUpdate"]["traits"]
-                )
-                for update_listener in self._update_listeners:
-                    update_listener(message["resourceUpdate"]["traits"])
-            else:
-                raise Exception(
-                    f"Unable to handle event for device {self.name}"
-                )
+        tracer = self.api.tracer
+        if tracer is None:
+            return self._apply_event(message)
+        with traced(tracer, "sdm.event_callback", {"sdm.device": self.name}):
+            return self._apply_event(message)
+
+    def _notify_update(self, traits, changes):
+        """Call the update listeners of an update, the filtered ones only
+        if it changed their fields."""
+        for update_listener in self._update_listeners:
+            update_listener(traits)
+        if changes and self._filtered_listeners:
+            for update_listener in self._affected_listeners(changes):
+                update_listener(traits)
+
+    def _apply_event(self, message):
+        """Apply an event and call the listeners, unless it is older than
+        the last applied one."""
+        timestamp = parse_timestamp_ns(message["timestamp"])
+        update = message["resourceUpdate"]
+        if "events" not in update and "traits" not in update:
+            raise Exception(
+                f"Unable to handle event for device {self.name}"
+            )
+        with self._write_lock:
+            if timestamp < self.last_updated_ns:
+                return
+            self.last_updated_ns = timestamp
+            if "events" not in update:
+                applied = update["traits"]
+                if self._pending_effects:
+                    applied = self._settle_effects(applied, timestamp)
+                traits, changes = deep_merge_copy(self.traits, applied)
+                # Publish the merged traits with a single reference swap
+                self.traits = traits
+                self._last_changes = changes
+                if changes:
+                    self._invalidate_traits({change[0] for change in changes})
+        if "events" in update:
+            for event_listener in self._event_listeners:
+                event_listener(update["events"])
+        else:
+            self._notify_update(applied, changes)
+        metrics = self.api.metrics
+        if metrics.enabled:
+            metrics.observe_event_lag((time.time_ns() - timestamp) / 1e9)
@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+from .metrics import SDMMetrics
+
+LOGGER = logging.getLogger("google-sdm")
+
+
+class SDMEventDispatcher:
+    """Bounded, sharded queue running device event callbacks off the Pub/Sub
+    subscriber threads.
+
+    Work is sharded on a key, the device name, over `workers` threads, each
+    with its own queue of at most `max_queue` items, so the events of one
+    device run in order while devices proceed in parallel. A full queue
+    blocks `submit` for up to `put_timeout` seconds (forever if None); if it
+    is still full the work is rejected and the message should be nacked.
+
+    `SDMAPI` acks a dispatched message only once its callback ran, so a
+    message lost with the queue, on a crash or a `stop` timeout, is
+    redelivered by Pub/Sub. Queued messages count against the flow control
+    of the subscriber until then.
+
+    The queue depth and the wait and run time of each callback are
+    recorded in `metrics`, by default those of the `SDMAPI`.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queue: int = 1000,
+        put_timeout: Optional[float] = 10.0,
+        metrics: Optional[SDMMetrics] = None,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.put_timeout = put_timeout
+        self.metrics = metrics
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self._threads = []
+        # Set by `stop` for the workers of the current `start`
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "max_depth": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "run_seconds": 0.0,
+            "max_run_seconds": 0.0,
+        }
+
+    def start(self):
+        """Start the worker threads, if they aren't running."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = threading.Event()
+            for index, shard in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(shard, self._stopping),
+                    name=f"google-sdm-dispatch-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Let the workers drain their queues, then stop them. Return once
+        they stopped or `timeout` seconds passed; the workers still
+        draining then stop once their queue is empty."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+            stopping = self._stopping
+        # The event is queued to wake up the idle workers, and set once
+        # queued: the workers of a full queue stop once they emptied it
+        for shard in self._queues:
+            try:
+                shard.put_nowait(stopping)
+            except queue.Full:
+                pass
+        stopping.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(0.0, deadline - time.monotonic()))
+
+    def submit(self, key: str, func, *args) -> bool:
+        """Queue `func(*args)` on the shard of `key`. Return whether it was
+        queued."""
+        if not self._threads:
+            self.start()
+        shard = self._queues[hash(key) % self.workers]
+        try:
+            shard.put((func, args, time.monotonic()), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        depth = shard.qsize()
+        with self._lock:
+            self._stats["submitted"] += 1
+            if depth > self._stats["max_depth"]:
+                self._stats["max_depth"] = depth
+        self._record_depth()
+        return True
+
+    def _work(self, shard, stopping):
+        while True:
+            item = shard.get()
+            if item is stopping:
+                self._record_depth()
+                return
+            if isinstance(item, threading.Event):
+                # Left over from an earlier stop
+                continue
+            func, args, queued = item
+            started = time.monotonic()
+            failed = False
+            try:
+                func(*args)
+            except Exception as e:
+                failed = True
+                LOGGER.error(f"Event dispatch failed: {e}")
+            wait = started - queued
+            run = time.monotonic() - started
+            with self._lock:
+                stats = self._stats
+                stats["failed" if failed else "completed"] += 1
+                stats["wait_seconds"] += wait
+                stats["run_seconds"] += run
+                if wait > stats["max_wait_seconds"]:
+                    stats["max_wait_seconds"] = wait
+                if run > stats["max_run_seconds"]:
+                    stats["max_run_seconds"] = run
+            metrics = self.metrics
+            if metrics is not None and metrics.enabled:
+                metrics.observe_dispatch(wait, run)
+                metrics.set_dispatch_depth(self.depth())
+            if stopping.is_set() and shard.empty():
+                return
+
+    def _record_depth(self):
+        metrics = self.metrics
+        if metrics is not None and metrics.enabled:
+            metrics.set_dispatch_depth(self.depth())
+
+    def depth(self) -> int:
+        """Return the number of queued items."""
+        return sum(shard.qsize() for shard in self._queues)
+
+    def stats(self) -> Dict[str, float]:
+        """Return the current queue depth and the counters and latencies
+        (seconds queued, seconds running) of the dispatched work."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["depth"] = self.depth()
+        return stats
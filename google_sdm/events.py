@@ -0,0 +1,297 @@
+import json
+import logging
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from .utils import parse_timestamp_ns
+
+LOGGER = logging.getLogger("google-sdm")
+
+_STOP = object()
+
+
+class SDMEventMessage:
+    """Message handed to the callback by the local event sources, with the
+    `data`, `message_id`, `ack()` and `nack()` of a Pub/Sub message."""
+
+    __slots__ = ("data", "message_id", "_source")
+
+    def __init__(self, data: bytes, message_id: str = "", source=None):
+        self.data = data
+        self.message_id = message_id
+        self._source = source
+
+    def __repr__(self):
+        return f"SDMEventMessage({self.message_id!r}, {self.data!r})"
+
+    def ack(self):
+        if self._source is not None:
+            self._source._count("acked")
+
+    def nack(self):
+        if self._source is not None:
+            self._source._count("nacked")
+            self._source._nacked(self)
+
+
+class SDMEventSource(ABC):
+    """Source of SDM event messages, feeding `SDMAPI.listen_events`."""
+
+    @abstractmethod
+    def start(self, callback: Callable):
+        """Start calling `callback` with each message, in the background.
+        """
+
+    @abstractmethod
+    def stop(self, timeout: Optional[float] = None):
+        """Stop delivering messages and wait for the callbacks in
+        progress."""
+
+
+class SDMPubSubEventSource(SDMEventSource):
+    """Events of a Google Cloud Pub/Sub subscription.
+
+    `flow_control` bounds the messages leased at once; it is a
+    `pubsub_v1.types.FlowControl` or a dictionary of its fields, such as
+    `max_messages` and `max_bytes`. `max_workers` sizes the thread pool
+    running the callbacks. Acks and nacks are batched by the subscriber's
+    streaming pull.
+    """
+
+    def __init__(
+        self,
+        subscription: str,
+        auth_path: Optional[str] = None,
+        auth: Optional[Dict] = None,
+        flow_control=None,
+        max_workers: Optional[int] = None,
+        await_callbacks_on_shutdown: bool = True,
+    ):
+        self.subscription = subscription
+        self.auth_path = auth_path
+        self.auth = auth
+        self.flow_control = flow_control
+        self.max_workers = max_workers
+        self.await_callbacks_on_shutdown = await_callbacks_on_shutdown
+        self.future = None
+        self._subscriber = None
+
+    def start(self, callback):
+        # Imported here, as grpc and protobuf are slow to import
+        from google.cloud import pubsub_v1
+        from google.oauth2 import service_account
+
+        if self.auth_path is not None:
+            subscriber = \
+                pubsub_v1.SubscriberClient.from_service_account_file(
+                    self.auth_path
+                )
+        else:
+            credentials = service_account.Credentials \
+                .from_service_account_info(self.auth)
+            subscriber = pubsub_v1.SubscriberClient(credentials=credentials)
+
+        kwargs = {}
+        flow_control = self.flow_control
+        if flow_control is not None:
+            if isinstance(flow_control, dict):
+                flow_control = pubsub_v1.types.FlowControl(**flow_control)
+            kwargs["flow_control"] = flow_control
+        if self.max_workers is not None:
+            kwargs["scheduler"] = \
+                pubsub_v1.subscriber.scheduler.ThreadScheduler(
+                    executor=ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="google-sdm-pubsub",
+                    )
+                )
+
+        self._subscriber = subscriber
+        self.future = subscriber.subscribe(
+            self.subscription,
+            callback,
+            await_callbacks_on_shutdown=self.await_callbacks_on_shutdown,
+            **kwargs
+        )
+
+    def stop(self, timeout=None):
+        if self.future is None:
+            return
+        self.future.cancel()
+        self.future.result(timeout=timeout)
+        self._subscriber.close()
+        self.future = None
+        self._subscriber = None
+
+
+class SDMQueueEventSource(SDMEventSource):
+    """In-process events, published with `put`.
+
+    Messages are delivered by `workers` threads (one keeps them in order)
+    from a queue of at most `max_queue` messages (unbounded if 0). Nacked
+    messages are delivered again if `redeliver` is set.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 0,
+        workers: int = 1,
+        redeliver: bool = False,
+    ):
+        self.workers = workers
+        self.redeliver = redeliver
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._callback = None
+        self._lock = threading.Lock()
+        self._ids = 0
+        self._stats = {"delivered": 0, "acked": 0, "nacked": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _nacked(self, message):
+        if self.redeliver:
+            self._queue.put(message)
+
+    def put(self, data, timeout: Optional[float] = None) -> SDMEventMessage:
+        """Publish an event, given as raw `bytes`, `str` or a dictionary."""
+        if isinstance(data, dict):
+            data = json.dumps(data)
+        if isinstance(data, str):
+            data = data.encode()
+        with self._lock:
+            self._ids += 1
+            message = SDMEventMessage(data, str(self._ids), self)
+        self._queue.put(message, timeout=timeout)
+        return message
+
+    def join(self):
+        """Wait until every published message was handled."""
+        self._queue.join()
+
+    def start(self, callback):
+        self._callback = callback
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work,
+                name=f"google-sdm-events-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _work(self):
+        while True:
+            message = self._queue.get()
+            try:
+                if message is _STOP:
+                    return
+                self._count("delivered")
+                self._callback(message)
+            except Exception as e:
+                LOGGER.error(f"Event callback failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the messages delivered, acked and nacked."""
+        with self._lock:
+            return dict(self._stats)
+
+
+class SDMReplayEventSource(SDMQueueEventSource):
+    """Events replayed from a JSONL capture of SDM messages, one message
+    per line.
+
+    Messages are paced on their `timestamp` at `speed` times the recorded
+    speed, or as fast as they are handled if `speed` is None. `wait`
+    returns once the whole capture was handled, and `stats` reports the
+    replay rate.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        speed: Optional[float] = 1.0,
+        max_queue: int = 1000,
+        workers: int = 1,
+    ):
+        super().__init__(max_queue=max_queue, workers=workers)
+        self.path = path
+        self.speed = speed
+        self._reader = None
+        self._stopped = threading.Event()
+        self._started = None
+        self._finished = None
+
+    def start(self, callback):
+        super().start(callback)
+        self._started = time.monotonic()
+        self._reader = threading.Thread(
+            target=self._replay,
+            name="google-sdm-replay",
+            daemon=True,
+        )
+        self._reader.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._reader is not None:
+            self._reader.join(timeout)
+        super().stop(timeout)
+
+    def _replay(self):
+        first = None
+        with open(self.path, "rb") as capture:
+            for line in capture:
+                line = line.strip()
+                if not line:
+                    continue
+                if self.speed:
+                    stamp = parse_timestamp_ns(
+                        json.loads(line)["timestamp"]
+                    ) / 1e9
+                    if first is None:
+                        first = (stamp, time.monotonic())
+                    delay = first[1] + (stamp - first[0]) / self.speed \
+                        - time.monotonic()
+                    if delay > 0 and self._stopped.wait(delay):
+                        return
+                while not self._stopped.is_set():
+                    try:
+                        self.put(line, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if self._stopped.is_set():
+                    return
+        self.join()
+        self._finished = time.monotonic()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the replay to complete. Return whether it did."""
+        self._reader.join(timeout)
+        return not self._reader.is_alive()
+
+    def stats(self) -> Dict[str, float]:
+        """Return the messages delivered, acked and nacked, the elapsed
+        seconds and the messages handled per second."""
+        stats = super().stats()
+        if self._started is not None:
+            elapsed = (self._finished or time.monotonic()) - self._started
+            stats["seconds"] = elapsed
+            stats["rate"] = stats["delivered"] / elapsed if elapsed else 0.0
+        return stats
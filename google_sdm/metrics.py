@@ -0,0 +1,239 @@
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Seconds, from a cached response to a slow command or a lagging event
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+_COMMAND_PREFIX = "sdm.devices.commands."
+
+
+def endpoint_label(endpoint: str) -> str:
+    """Return the template of an endpoint path, without the resource ids,
+    e.g. `devices/*:executeCommand` for
+    `enterprises/p/devices/d:executeCommand`."""
+    path, colon, verb = endpoint.partition(":")
+    parts = path.split("/")
+    label = "/".join(
+        "*" if index % 2 else part
+        for index, part in enumerate(parts)
+    )[len("enterprises/*/"):]
+    return f"{label}{colon}{verb}"
+
+
+def command_label(command: str) -> str:
+    """Return a command without its common prefix, e.g.
+    `ThermostatMode.SetMode`."""
+    if command.startswith(_COMMAND_PREFIX):
+        return command[len(_COMMAND_PREFIX):]
+    return command
+
+
+class SDMMetrics:
+    """Sink of the metrics of an `SDMAPI`. This base class discards them.
+
+    Recording is skipped altogether while `enabled` is false, so the
+    default sink costs an attribute check per request or message.
+    Subclasses set `enabled` and implement the `observe_*` and `count_*`
+    methods; they are called from any thread.
+    """
+
+    enabled = False
+
+    def observe_request(self, endpoint: str, method: str, status: str,
+                        seconds: float):
+        """Record an HTTP request to `endpoint` (see `endpoint_label`)
+        answered with `status`, or "error" if it raised."""
+
+    def observe_command(self, command: str, status: str, seconds: float):
+        """Record an `:executeCommand` call of `command` (see
+        `command_label`), retries included."""
+
+    def observe_token_refresh(self, outcome: str, seconds: float):
+        """Record a token refresh, its outcome being "ok" or "error"."""
+
+    def count_message(self, outcome: str, reason: str):
+        """Count a Pub/Sub message acked or nacked (`outcome`) for
+        `reason`."""
+
+    def observe_event_lag(self, seconds: float):
+        """Record the delay from the SDM `timestamp` of an event to the
+        completion of its listeners."""
+
+    def observe_dispatch(self, wait: float, run: float):
+        """Record an event callback run by the `SDMEventDispatcher`, after
+        `wait` seconds in its queue, for `run` seconds."""
+
+    def set_dispatch_depth(self, depth: int):
+        """Record the number of callbacks queued in the
+        `SDMEventDispatcher`."""
+
+
+class _Histogram:
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+
+class SDMPrometheusMetrics(SDMMetrics):
+    """Metrics kept in memory and rendered in the Prometheus text
+    exposition format by `render`, e.g. for an HTTP scrape handler.
+
+    Latencies are histograms over `buckets` (seconds). Series:
+
+    - `sdm_request_seconds{endpoint,method}` and
+      `sdm_requests_total{endpoint,method,status}`
+    - `sdm_command_seconds{command}` and
+      `sdm_commands_total{command,status}`
+    - `sdm_token_refresh_seconds` and `sdm_token_refreshes_total{outcome}`
+    - `sdm_messages_total{outcome,reason}`
+    - `sdm_event_lag_seconds`
+    - `sdm_dispatch_wait_seconds`, `sdm_dispatch_run_seconds` and the
+      `sdm_dispatch_queue_depth` gauge
+    """
+
+    enabled = True
+
+    HELP = {
+        "sdm_request_seconds": "SDM API request latency.",
+        "sdm_requests_total": "SDM API requests by response status.",
+        "sdm_command_seconds": "Command latency, retries included.",
+        "sdm_commands_total": "Commands by response status.",
+        "sdm_token_refresh_seconds": "OAuth token refresh latency.",
+        "sdm_token_refreshes_total": "OAuth token refreshes by outcome.",
+        "sdm_messages_total": "Pub/Sub messages acked or nacked by reason.",
+        "sdm_event_lag_seconds":
+            "Delay from the event timestamp to its handling.",
+        "sdm_dispatch_wait_seconds": "Time event callbacks spent queued.",
+        "sdm_dispatch_run_seconds": "Event callback run time.",
+        "sdm_dispatch_queue_depth": "Event callbacks queued.",
+    }
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 prefix: str = ""):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def _observe(self, name: str, labels: Tuple, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = _Histogram(self.buckets)
+            if index < len(self.buckets):
+                histogram.counts[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def _count(self, name: str, labels: Tuple):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + 1
+
+    def observe_request(self, endpoint, method, status, seconds):
+        labels = (("endpoint", endpoint), ("method", method.upper()))
+        self._observe("sdm_request_seconds", labels, seconds)
+        self._count("sdm_requests_total", labels + (("status", status),))
+
+    def observe_command(self, command, status, seconds):
+        labels = (("command", command),)
+        self._observe("sdm_command_seconds", labels, seconds)
+        self._count("sdm_commands_total", labels + (("status", status),))
+
+    def observe_token_refresh(self, outcome, seconds):
+        self._observe("sdm_token_refresh_seconds", (), seconds)
+        self._count("sdm_token_refreshes_total", (("outcome", outcome),))
+
+    def count_message(self, outcome, reason):
+        self._count(
+            "sdm_messages_total", (("outcome", outcome), ("reason", reason))
+        )
+
+    def observe_event_lag(self, seconds):
+        self._observe("sdm_event_lag_seconds", (), seconds)
+
+    def observe_dispatch(self, wait, run):
+        self._observe("sdm_dispatch_wait_seconds", (), wait)
+        self._observe("sdm_dispatch_run_seconds", (), run)
+
+    def set_dispatch_depth(self, depth):
+        with self._lock:
+            self._gauges.setdefault("sdm_dispatch_queue_depth", {})[()] = depth
+
+    def stats(self) -> Dict[str, Dict]:
+        """Return the counters and gauges, and the count and sum of the
+        histograms, keyed by metric name then by labels."""
+        with self._lock:
+            stats = {
+                name: dict(series)
+                for name, series in (*self._counters.items(),
+                                     *self._gauges.items())
+            }
+            for name, series in self._histograms.items():
+                stats[name] = {
+                    labels: {"count": histogram.count, "sum": histogram.sum}
+                    for labels, histogram in series.items()
+                }
+        return stats
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        labels = labels + extra
+        if not labels:
+            return ""
+        return "{" + ",".join(
+            f'{key}="{_escape(value)}"' for key, value in labels
+        ) + "}"
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            names = set(self._histograms) | set(self._counters) \
+                | set(self._gauges)
+            for name in sorted(names):
+                full = f"{self.prefix}{name}"
+                if name in self._counters:
+                    kind, values = "counter", self._counters[name]
+                elif name in self._gauges:
+                    kind, values = "gauge", self._gauges[name]
+                else:
+                    kind = "histogram"
+                lines.append(f"# HELP {full} {self.HELP.get(name, name)}")
+                lines.append(f"# TYPE {full} {kind}")
+                if kind != "histogram":
+                    for labels, value in values.items():
+                        lines.append(f"{full}{self._labels(labels)} {value}")
+                    continue
+                for labels, histogram in self._histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, histogram.counts):
+                        cumulative += count
+                        le = self._labels(labels, (("le", f"{bound:g}"),))
+                        lines.append(f"{full}_bucket{le} {cumulative}")
+                    le = self._labels(labels, (("le", "+Inf"),))
+                    lines.append(f"{full}_bucket{le} {histogram.count}")
+                    lines.append(
+                        f"{full}_sum{self._labels(labels)} {histogram.sum}"
+                    )
+                    lines.append(
+                        f"{full}_count{self._labels(labels)} "
+                        + f"{histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
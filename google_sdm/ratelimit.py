@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def device_of(path: str) -> Optional[str]:
+    """Return the device name an endpoint path belongs to, if any, e.g.
+    `enterprises/p/devices/d` for `enterprises/p/devices/d:executeCommand`.
+    """
+    parts = path.split(":", 1)[0].split("/")
+    if len(parts) >= 4 and parts[2] == "devices":
+        return "/".join(parts[:4])
+    return None
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Parse a `Retry-After` header, either delay-seconds or an HTTP
+    date, into seconds from now."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second with bursts of up
+    to `burst` requests. Tokens are reserved ahead: a caller is told how
+    long to wait for its token instead of polling for it."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return the seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._stamp) * self.rate
+            )
+            self._stamp = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class SDMRateLimiter:
+    """Client side quota handling for `SDMAPI._request`.
+
+    Requests are spaced by a project wide token bucket and, for device
+    endpoints, a per device token bucket (`None` rates disable a bucket).
+    Responses with a status in `retry_statuses` are retried up to
+    `max_retries` times, waiting for `Retry-After` when the server sends it
+    and for an exponential backoff with full jitter otherwise.
+    """
+
+    def __init__(
+        self,
+        project_qps: Optional[float] = None,
+        project_burst: Optional[float] = None,
+        device_qps: Optional[float] = None,
+        device_burst: Optional[float] = None,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 32.0,
+        retry_statuses=RETRY_STATUSES,
+    ):
+        self.project_bucket = None
+        if project_qps:
+            self.project_bucket = TokenBucket(project_qps, project_burst)
+        self.device_qps = device_qps
+        self.device_burst = device_burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = frozenset(retry_statuses)
+        self._device_buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "limited_requests": 0,
+            "limited_seconds": 0.0,
+            "retries": 0,
+            "backoff_seconds": 0.0,
+        }
+
+    def _device_bucket(self, device):
+        bucket = self._device_buckets.get(device)
+        if bucket is None:
+            with self._lock:
+                bucket = self._device_buckets.setdefault(
+                    device, TokenBucket(self.device_qps, self.device_burst)
+                )
+        return bucket
+
+    def acquire(self, path: str) -> float:
+        """Reserve quota for a request to `path` and return the seconds to
+        wait before sending it."""
+        delay = 0.0
+        if self.project_bucket is not None:
+            delay = self.project_bucket.reserve()
+        if self.device_qps:
+            device = device_of(path)
+            if device is not None:
+                delay = max(delay, self._device_bucket(device).reserve())
+        with self._lock:
+            self._stats["requests"] += 1
+            if delay > 0:
+                self._stats["limited_requests"] += 1
+                self._stats["limited_seconds"] += delay
+        return delay
+
+    def retry_delay(self, status: int, headers, attempt: int) \
+            -> Optional[float]:
+        """Return the seconds to wait before retrying a response, or None
+        if it should not be retried."""
+        if status not in self.retry_statuses or attempt >= self.max_retries:
+            return None
+        delay = random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        )
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._lock:
+            self._stats["retries"] += 1
+            self._stats["backoff_seconds"] += delay
+        return delay
+
+    def stats(self) -> Dict[str, float]:
+        """Return counters of the requests made and the time spent
+        throttled, either by the buckets or by backing off."""
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,232 @@
+import threading
+from typing import Iterator, List, Optional
+
+
+def parent_structure(parent: str) -> Optional[str]:
+    """Return the structure name out of a `parentRelations` parent, which
+    is either a structure or a room of a structure."""
+    marker = parent.find("/rooms/")
+    if marker != -1:
+        return parent[:marker]
+    if "/structures/" in parent:
+        return parent
+    return None
+
+
+class _DeviceIndex:
+    """Immutable state of an `SDMDeviceRegistry`: the devices by name and
+    their secondary indexes, built once and never modified."""
+
+    __slots__ = ("by_name", "by_type", "by_structure", "by_room", "devices")
+
+    def __init__(self, by_name, by_type, by_structure, by_room):
+        self.by_name = by_name
+        self.by_type = by_type
+        self.by_structure = by_structure
+        self.by_room = by_room
+        self.devices = tuple(by_name.values())
+
+    @classmethod
+    def build(cls, by_name):
+        """Index the devices of `by_name` from scratch."""
+        return cls({}, {}, {}, {}).updated(add=by_name.values())[0]
+
+    def updated(self, add=(), remove=(), moved=()):
+        """Return a new index with the devices named in `remove` removed,
+        those of `add` added and the `(device, previous parentRelations)`
+        of `moved` indexed under their current relations, and the removed
+        devices. Only the index buckets of these devices are copied."""
+        by_name = dict(self.by_name)
+        indexes = (self.by_type, self.by_structure, self.by_room)
+        # Working copies of the touched buckets, per index
+        buckets = ({}, {}, {})
+
+        def edit(device, adding, relations=None):
+            for index, work, bucket_keys in zip(
+                indexes, buckets, _keys(device, relations)
+            ):
+                for key in bucket_keys:
+                    bucket = work.get(key)
+                    if bucket is None:
+                        bucket = work[key] = list(index.get(key, ()))
+                    if adding:
+                        bucket.append(device)
+                    elif device in bucket:
+                        bucket.remove(device)
+
+        for device, relations in moved:
+            if by_name.get(device.name) is device:
+                edit(device, False, relations)
+                edit(device, True)
+        removed = []
+        for name in remove:
+            device = by_name.pop(name, None)
+            if device is not None:
+                removed.append(device)
+                edit(device, False)
+        for device in add:
+            previous = by_name.pop(device.name, None)
+            if previous is not None:
+                edit(previous, False)
+            by_name[device.name] = device
+            edit(device, True)
+
+        new_indexes = []
+        for index, work in zip(indexes, buckets):
+            index = dict(index)
+            for key, bucket in work.items():
+                if bucket:
+                    index[key] = tuple(bucket)
+                else:
+                    index.pop(key, None)
+            new_indexes.append(index)
+        return _DeviceIndex(by_name, *new_indexes), removed
+
+
+def _keys(device, relations=None):
+    """Return the keys of a device in the type, structure and room
+    indexes, as of `relations` if given, else its `parentRelations`."""
+    structures, rooms = _parents(
+        device.parentRelations if relations is None else relations
+    )
+    return ((device.type,), structures, rooms)
+
+
+def _parents(relations):
+    rooms = []
+    structures = []
+    for relation in relations:
+        parent = relation.get("parent")
+        if not parent:
+            continue
+        structure = parent_structure(parent)
+        if structure is not None and structure not in structures:
+            structures.append(structure)
+        if structure is not None and structure != parent:
+            rooms.append(parent)
+    return structures, rooms
+
+
+class SDMDeviceRegistry:
+    """Collection of `SDMDevice` instances keyed by name, with secondary
+    indexes by device type, parent structure and parent room.
+
+    The registry is copy-on-write: writers, serialized by `lock`, build a
+    new immutable index and swap it in, so readers take no lock and always
+    see a consistent set of devices. A change copies the name table and
+    the index buckets of the devices it touches; use `update` to apply
+    many changes with a single copy.
+    """
+
+    def __init__(self, devices=None):
+        self.lock = threading.RLock()
+        self._index = _DeviceIndex.build({})
+        if devices:
+            self.update(add=devices)
+
+    def __len__(self):
+        return len(self._index.by_name)
+
+    def __bool__(self):
+        return bool(self._index.by_name)
+
+    def __iter__(self) -> Iterator:
+        return iter(self._index.devices)
+
+    def __contains__(self, name):
+        return name in self._index.by_name
+
+    def __repr__(self):
+        return f"SDMDeviceRegistry({self.list()})"
+
+    def update(self, add=(), remove=(), moved=()):
+        """Reindex the `(device, previous parentRelations)` of `moved`,
+        whose relations changed in place, remove the devices named in
+        `remove`, then add the devices of `add`, replacing those with the
+        same name, and publish the result at once. Return the removed
+        devices."""
+        with self.lock:
+            self._index, removed = self._index.updated(add, remove, moved)
+        return removed
+
+    def add(self, device):
+        """Add a device, replacing any device with the same name."""
+        self.update(add=(device,))
+
+    def reindex(self):
+        """Rebuild the indexes from scratch."""
+        with self.lock:
+            self._index = _DeviceIndex.build(self._index.by_name)
+
+    def remove(self, name):
+        """Remove and return the device with the given name, if any."""
+        removed = self.update(remove=(name,))
+        return removed[0] if removed else None
+
+    def clear(self):
+        with self.lock:
+            self._index = _DeviceIndex.build({})
+
+    def get(self, name, default=None):
+        """Return the device with the given name."""
+        return self._index.by_name.get(name, default)
+
+    def list(self) -> List:
+        """Return all devices, in insertion order."""
+        return list(self._index.devices)
+
+    def by_type(self, device_type) -> List:
+        """Return the devices of a type, e.g.
+        `sdm.devices.types.THERMOSTAT`."""
+        return list(self._index.by_type.get(device_type, ()))
+
+    def by_structure(self, structure) -> List:
+        """Return the devices whose parent is the structure, or one of
+        its rooms."""
+        return list(self._index.by_structure.get(structure, ()))
+
+    def by_room(self, room) -> List:
+        """Return the devices whose parent is the room."""
+        return list(self._index.by_room.get(room, ()))
+
+
+class SDMStructureRegistry:
+    """Copy-on-write collection of `SDMStructure` instances keyed by name,
+    replaced as a whole by `replace`."""
+
+    def __init__(self, structures=None):
+        self.lock = threading.RLock()
+        self._state = ({}, ())
+        if structures:
+            self.replace(structures)
+
+    def __len__(self):
+        return len(self._state[1])
+
+    def __bool__(self):
+        return bool(self._state[1])
+
+    def __iter__(self) -> Iterator:
+        return iter(self._state[1])
+
+    def __contains__(self, name):
+        return name in self._state[0]
+
+    def __repr__(self):
+        return f"SDMStructureRegistry({self.list()})"
+
+    def replace(self, structures):
+        """Publish `structures` in place of the current ones."""
+        structures = tuple(structures)
+        self._state = (
+            {structure.name: structure for structure in structures},
+            structures,
+        )
+
+    def get(self, name, default=None):
+        """Return the structure with the given name."""
+        return self._state[0].get(name, default)
+
+    def list(self) -> List:
+        """Return all structures."""
+        return list(self._state[1])
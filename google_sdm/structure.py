@@ -17,6 +17,10 @@ class SDMStructure:
         self.api = api
         self.name = name
         self.traits = traits or {}
+        self._trait_cache = {}
+        # Last loaded rooms, and whether they come from a snapshot
+        self._rooms = None
+        self._rooms_warm = False
 
     def __repr__(self):
         rep = "SDMStructure("
@@ -32,10 +36,39 @@ class SDMStructure:
         """Get data (as dictionary) from an endpoint."""
         return self.api._get(f"{self.name}{endpoint}")
 
-    def get_rooms(self):
-        """Get structure rooms."""
-        data = self._get("/rooms")
-        return [SDMStructure.Room(self.api, **app) for app in data["rooms"]]
+    def _reconcile(self, traits=None, **kwargs):
+        """Update the structure in place from a freshly fetched resource.
+        Return whether anything changed."""
+        if (traits or {}) == self.traits:
+            return False
+        self.traits = traits or {}
+        self._trait_cache = {}
+        return True
+
+    def _load_rooms(self, data, warm=False):
+        self._rooms = [
+            SDMStructure.Room(self.api, **app) for app in data["rooms"]
+        ]
+        self._rooms_warm = warm
+
+    def _snapshot(self):
+        """Return the structure and its rooms, if loaded, for
+        `SDMAPI.save_snapshot`."""
+        return {
+            "resource": {"name": self.name, "traits": self.traits},
+            "rooms": None if self._rooms is None else [
+                {"name": room.name, "traits": room.traits}
+                for room in self._rooms
+            ],
+        }
+
+    def get_rooms(self, refresh=False):
+        """Get structure rooms, through the response cache of the API.
+        Rooms warm-started from a snapshot are returned until the first
+        fetch, or `refresh`."""
+        if refresh or not self._rooms_warm:
+            self._load_rooms(self._get("/rooms"))
+        return list(self._rooms)
 
     @SDMTraitGetter(StructureInfoTrait)
     def get_info(self, **kwargs) \
@@ -58,6 +91,7 @@ class SDMStructure:
             self.api = api
             self.name = name
             self.traits = traits or {}
+            self._trait_cache = {}
 
         def __repr__(self):
             rep = "SDMStructure.Room("
@@ -0,0 +1,12 @@
+from .fleet import (
+    generate_events,
+    generate_fleet,
+    write_capture,
+)
+from .server import (
+    SDMStandInServer,
+    constant,
+    exponential,
+    lognormal,
+    uniform,
+)
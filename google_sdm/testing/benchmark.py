@@ -0,0 +1,660 @@
+"""Benchmarks of the hot paths against synthetic fleets.
+
+Run `python -m google_sdm.testing.benchmark --help`. Results are written as
+JSON, and a previous result file can be passed to `--compare` to report
+regressions.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from ..api import ENDPOINT_DEVICES, SDMAPI
+from ..cache import SDMResponseCache
+from ..codec import SDMCodec, default_codec
+from ..devices import SDMThermostat
+from ..events import SDMEventMessage
+from ..metrics import SDMPrometheusMetrics
+from ..utils import deep_merge_copy, parse_timestamp, parse_timestamp_ns
+from .fleet import generate_events, generate_fleet
+from .server import SDMStandInServer
+
+_Response = namedtuple("_Response", ["status_code", "headers", "content"])
+
+_IMPORT_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import google_sdm
+for module in sys.argv[1:]:
+    try:
+        __import__(module)
+    except ImportError:
+        pass
+elapsed = time.perf_counter() - started
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss *= 1 if sys.platform == "darwin" else 1024
+except ImportError:
+    rss = 0
+print(elapsed, rss)
+"""
+
+# What `import google_sdm` used to import eagerly
+_EAGER_IMPORTS = (
+    "asyncio",
+    "aiohttp",
+    "google.cloud.pubsub_v1",
+    "google.oauth2.service_account",
+    "requests_oauthlib",
+)
+
+_THERMOSTAT_GETTERS = (
+    "get_info",
+    "get_connectivity",
+    "get_fan",
+    "get_humidity",
+    "get_settings",
+    "get_temperature",
+    "get_thermostat_eco",
+    "get_thermostat_hvac",
+    "get_thermostat_mode",
+    "get_thermostat_temperature_setpoint",
+)
+
+
+def measure(func: Callable, ops: int, repeat: int = 3,
+            setup: Optional[Callable] = None) -> Dict[str, float]:
+    """Time `func`, which performs `ops` operations, keeping the best of
+    `repeat` runs. `setup`, if given, runs untimed before each run and its
+    result is passed to `func`."""
+    best = None
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        gc.collect()
+        started = time.perf_counter()
+        func(arg) if setup is not None else func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "ops": ops,
+        "seconds": best,
+        "ops_per_second": ops / best if best else 0.0,
+        "us_per_op": best / ops * 1e6 if ops else 0.0,
+    }
+
+
+def fake_api(fleet: Dict, **kwargs) -> SDMAPI:
+    """Return an `SDMAPI` answering `get_devices` from `fleet` without
+    network."""
+    api = SDMAPI(project_id="project-id", **kwargs)
+    content = json.dumps({"devices": fleet["devices"]}).encode()
+    devices = ENDPOINT_DEVICES.format(api.project_id)
+
+    def send(method, url, **kwargs):
+        if url.endswith(devices):
+            return _Response(200, {}, content)
+        return _Response(200, {}, b"{}")
+    api._send = send
+    return api
+
+
+def bench_get_devices(fleet, repeat):
+    """Parse the device listing into `SDMDevice` instances."""
+    return measure(
+        lambda api: api.get_devices(),
+        len(fleet["devices"]),
+        repeat,
+        setup=lambda: fake_api(fleet),
+    )
+
+
+def bench_refresh_devices(fleet, repeat):
+    """Reconcile an unchanged device listing with the known devices."""
+    api = fake_api(fleet)
+    api.get_devices()
+    return measure(
+        lambda: api.get_devices(refresh=True),
+        len(fleet["devices"]),
+        repeat,
+    )
+
+
+def bench_lookup(fleet, repeat, sizes=(1000, 10000, 100000), lookups=10000):
+    """Look devices up by name in registries of growing size; the cost per
+    lookup should stay flat."""
+    results = {}
+    for size in sizes:
+        api = SDMAPI(project_id="project-id")
+        api._devices.update(add=[
+            SDMThermostat(
+                api,
+                type=SDMThermostat.STR_REPR,
+                name=f"enterprises/project-id/devices/D{index:08d}",
+            )
+            for index in range(size)
+        ])
+        devices = api.get_devices()
+        names = [
+            devices[index * 7919 % size].name for index in range(lookups)
+        ]
+        get_device = api.get_device
+        results[str(size)] = measure(
+            lambda: [get_device(name) for name in names],
+            len(names),
+            repeat,
+        )
+    return results
+
+
+def bench_handle_message(fleet, repeat, events=20000, **kwargs):
+    """Handle Pub/Sub messages end to end: dedup, decode, routing, timestamp
+    parsing, merge and listener fan-out."""
+    api = fake_api(fleet, **kwargs)
+    for device in api.get_devices():
+        device.register_update_listener(lambda traits: None)
+        device.register_event_listener(lambda events: None)
+    seeds = iter(range(repeat))
+
+    def setup():
+        return [
+            SDMEventMessage(json.dumps(event).encode())
+            for event in generate_events(fleet, events, seed=next(seeds))
+        ]
+
+    def run(messages):
+        handle = api._handle_message
+        for message in messages:
+            handle(message)
+    return measure(run, events, repeat, setup=setup)
+
+
+def bench_metrics(fleet, repeat, events=20000):
+    """Handle Pub/Sub messages with the default (disabled) metrics and with
+    Prometheus metrics recording."""
+    return {
+        "disabled": bench_handle_message(fleet, repeat, events),
+        "prometheus": bench_handle_message(
+            fleet, repeat, events, metrics=SDMPrometheusMetrics()
+        ),
+    }
+
+
+def bench_decode(fleet, repeat, events=20000):
+    """Decode Pub/Sub message bytes with the stdlib and default codecs."""
+    messages = [
+        json.dumps(event).encode()
+        for event in generate_events(fleet, events)
+    ]
+    results = {}
+    for codec in (SDMCodec(), default_codec()):
+        loads = codec.loads
+        results[codec.name] = measure(
+            lambda: [loads(message) for message in messages],
+            events,
+            repeat,
+        )
+    return results
+
+
+def bench_timestamp(fleet, repeat, events=20000):
+    """Parse event timestamps into nanoseconds and into a `datetime`, and,
+    under `stdlib`, into a `datetime` with `strptime` and `fromisoformat`
+    (given `+00:00` for `Z`, which it only takes as of Python 3.11).
+    `speedup` is the ops/s of `parse_timestamp_ns` over those of the
+    stdlib."""
+    stamps = [event["timestamp"] for event in generate_events(fleet, events)]
+
+    def bench(parse):
+        return measure(
+            lambda: [parse(stamp) for stamp in stamps], events, repeat
+        )
+
+    results = {
+        "parse_timestamp_ns": bench(parse_timestamp_ns),
+        "parse_timestamp": bench(parse_timestamp),
+        "stdlib": {
+            "strptime": bench(lambda stamp: datetime.strptime(
+                stamp, "%Y-%m-%dT%H:%M:%S.%f%z"
+            )),
+            "fromisoformat": bench(lambda stamp: datetime.fromisoformat(
+                stamp[:-1] + "+00:00"
+            )),
+        },
+    }
+    ops = results["parse_timestamp_ns"]["ops_per_second"]
+    results["speedup"] = {
+        name: ops / result["ops_per_second"]
+        for name, result in results["stdlib"].items()
+    }
+    return results
+
+
+def bench_deep_merge(fleet, repeat, events=20000):
+    """Merge trait updates into thermostat traits, copy-on-write as device
+    events do."""
+    thermostats = [
+        device for device in fleet["devices"]
+        if device["type"] == SDMThermostat.STR_REPR
+    ] or fleet["devices"]
+    updates = [
+        event["resourceUpdate"].get("traits", {})
+        for event in generate_events(fleet, events)
+    ]
+
+    targets = [
+        thermostats[index % len(thermostats)]["traits"]
+        for index in range(events)
+    ]
+
+    def run():
+        for target, update in zip(targets, updates):
+            deep_merge_copy(target, update)
+    return measure(run, events, repeat)
+
+
+def bench_listeners(fleet, repeat, events=20000, listeners=50):
+    """Handle thermostat updates on devices with `listeners` update
+    listeners each, unfiltered or subscribed to single fields of which
+    one in ten is the ambient temperature. Both are dominated by decoding
+    and merging the events; the filtered listeners only add a lookup of
+    the listeners of each changed path."""
+    thermostats = [
+        device for device in fleet["devices"]
+        if device["type"] == SDMThermostat.STR_REPR
+    ]
+    if not thermostats:
+        return {}
+    fleet = dict(fleet, devices=thermostats)
+    fields = [
+        f"{trait}.{field}"
+        for trait, values in thermostats[0]["traits"].items()
+        for field in values
+    ]
+    temperature = "sdm.devices.traits.Temperature.ambientTemperatureCelsius"
+    others = [field for field in fields if field != temperature]
+    calls = []
+
+    def listener(traits):
+        calls.append(traits)
+
+    results = {}
+    for name in ("unfiltered", "filtered"):
+        api = fake_api(fleet)
+        for device in api.get_devices():
+            for index in range(listeners):
+                if name == "unfiltered":
+                    device.register_update_listener(listener)
+                else:
+                    field = temperature if index % 10 == 0 \
+                        else others[index % len(others)]
+                    device.register_update_listener(listener, fields=[field])
+        seeds = iter(range(repeat))
+
+        def setup():
+            return [
+                SDMEventMessage(json.dumps(event).encode())
+                for event in generate_events(
+                    fleet, events, seed=100 + next(seeds)
+                )
+            ]
+
+        def run(messages):
+            handle = api._handle_message
+            for message in messages:
+                handle(message)
+            calls.clear()
+        results[name] = measure(run, events, repeat, setup=setup)
+    return results
+
+
+def bench_trait_getters(fleet, repeat, calls=200000):
+    """Call thermostat trait getters, with warm and cold trait views."""
+    api = fake_api(fleet)
+    thermostats = [
+        device for device in api.get_devices()
+        if isinstance(device, SDMThermostat)
+    ]
+    if not thermostats:
+        return {}
+    getters = [
+        getattr(thermostats[index % len(thermostats)], name)
+        for index, name in enumerate(
+            _THERMOSTAT_GETTERS * (calls // len(_THERMOSTAT_GETTERS))
+        )
+    ]
+
+    def run():
+        for getter in getters:
+            getter()
+
+    def run_cold():
+        for getter in getters:
+            getter.__self__._invalidate_traits()
+            getter()
+    return {
+        "warm": measure(run, len(getters), repeat),
+        "cold": measure(run_cold, len(getters), repeat),
+    }
+
+
+def bench_concurrent_reads(fleet, repeat, reads=20000, readers=4,
+                           events=20000):
+    """Look devices up and read thermostat trait views from `readers`
+    threads, idle and while another thread handles Pub/Sub messages and
+    relation refreshes. Reads iterating a device's traits while it is
+    updated count as `errors`; there should be none."""
+    api = fake_api(fleet)
+    devices = api.get_devices()
+    thermostats = [
+        device for device in devices if isinstance(device, SDMThermostat)
+    ]
+    if not thermostats:
+        return {}
+    names = [thermostats[index % len(thermostats)].name
+             for index in range(reads)]
+    getters = _THERMOSTAT_GETTERS
+    errors = []
+
+    def read():
+        get_device = api.get_device
+        for index, name in enumerate(names):
+            device = get_device(name)
+            getattr(device, getters[index % len(getters)])()
+            try:
+                for trait in device.traits.values():
+                    len(trait)
+            except RuntimeError:
+                errors.append(name)
+            len(api.get_devices())
+
+    def run_readers():
+        threads = [threading.Thread(target=read) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    seeds = iter(range(repeat))
+
+    def setup():
+        return [
+            SDMEventMessage(json.dumps(event).encode())
+            for event in generate_events(fleet, events, seed=next(seeds))
+        ]
+
+    def run_loaded(messages):
+        done = threading.Event()
+
+        def write():
+            handle = api._handle_message
+            while not done.is_set():
+                for index, message in enumerate(messages):
+                    if done.is_set():
+                        break
+                    handle(message)
+                    if index % 1000 == 0:
+                        api._refresh_relations()
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            run_readers()
+        finally:
+            done.set()
+            writer.join()
+
+    ops = reads * readers
+    results = {
+        "idle": measure(run_readers, ops, repeat),
+        "events": measure(run_loaded, ops, repeat, setup=setup),
+    }
+    results["events"]["errors"] = len(errors)
+    return results
+
+
+def bench_revalidate(fleet, repeat, requests=200):
+    """Refresh the device listing against a local `SDMStandInServer` with
+    an expired cache entry, so every request is a conditional GET answered
+    304, from the sync and the asyncio clients."""
+    # The stand-in serves plain HTTP
+    os.environ.setdefault("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    results = {}
+    with SDMStandInServer(fleet=fleet) as server:
+        def client(api_type):
+            return api_type(
+                token=server.issue_token(),
+                project_id=server.project_id,
+                client_id="client-id",
+                client_secret="client-secret",
+                api_url=server.url,
+                token_url=server.token_url,
+                cache=SDMResponseCache(ttls={"devices": 0}),
+            )
+
+        api = client(SDMAPI)
+        api.get_devices()
+
+        def run():
+            for _ in range(requests):
+                api.get_devices(refresh=True)
+        before = server.stats()["not_modified"]
+        results["sync"] = measure(run, requests, repeat)
+        results["sync"]["not_modified"] = \
+            server.stats()["not_modified"] - before
+        api.close()
+
+        try:
+            from ..aio import SDMAsyncAPI
+        except ImportError:  # pragma: no cover
+            return results
+
+        async def run_async():
+            async with client(SDMAsyncAPI) as api:
+                await api.get_devices()
+                started = time.perf_counter()
+                for _ in range(requests):
+                    await api.get_devices(refresh=True)
+                return time.perf_counter() - started
+        before = server.stats()["not_modified"]
+        best = min(asyncio.run(run_async()) for _ in range(repeat))
+        results["async"] = {
+            "ops": requests,
+            "seconds": best,
+            "ops_per_second": requests / best if best else 0.0,
+            "us_per_op": best / requests * 1e6,
+            "not_modified": server.stats()["not_modified"] - before,
+        }
+    return results
+
+
+def _measure_import(repeat, modules=()):
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SCRIPT, *modules],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout.split()
+        seconds, rss = float(output[0]), int(output[1])
+        if best is None or seconds < best["seconds"]:
+            best = {"seconds": seconds, "max_rss_bytes": rss}
+    return dict(
+        best,
+        ops=1,
+        ops_per_second=1 / best["seconds"],
+        us_per_op=best["seconds"] * 1e6,
+    )
+
+
+def bench_import(fleet, repeat):
+    """Time `import google_sdm` and its peak resident memory in a fresh
+    interpreter, alone and followed by the dependencies it used to import
+    eagerly (Pub/Sub, OAuth, aiohttp)."""
+    return {
+        "lazy": _measure_import(repeat),
+        "eager": _measure_import(repeat, _EAGER_IMPORTS),
+    }
+
+
+def bench_memory(fleet, repeat):
+    """Measure the memory held per device once loaded, with every trait
+    view built."""
+    api = fake_api(fleet)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        devices = api.get_devices()
+        for device in devices:
+            for name in _THERMOSTAT_GETTERS:
+                getter = getattr(device, name, None)
+                try:
+                    getter is not None and getter()
+                except KeyError:
+                    pass
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "devices": len(devices),
+        "bytes_per_device": current / max(1, len(devices)),
+        "peak_bytes": peak,
+    }
+
+
+BENCHMARKS = {
+    "get_devices": bench_get_devices,
+    "refresh_devices": bench_refresh_devices,
+    "lookup": bench_lookup,
+    "handle_message": bench_handle_message,
+    "metrics": bench_metrics,
+    "decode": bench_decode,
+    "timestamp": bench_timestamp,
+    "deep_merge": bench_deep_merge,
+    "trait_getters": bench_trait_getters,
+    "concurrent_reads": bench_concurrent_reads,
+    "revalidate": bench_revalidate,
+    "listeners": bench_listeners,
+    "memory": bench_memory,
+    "import": bench_import,
+}
+
+
+def run(fleet_options: Dict, names: Optional[List[str]] = None,
+        repeat: int = 3) -> Dict:
+    """Run the benchmarks `names` (all by default) on a fleet generated
+    with `fleet_options` and return the machine readable results."""
+    fleet = generate_fleet(**fleet_options)
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = BENCHMARKS[name](fleet, repeat)
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "codec": default_codec().name,
+            "fleet": dict(fleet_options, devices=len(fleet["devices"])),
+            "repeat": repeat,
+            "time": time.time(),
+        },
+        "results": results,
+    }
+
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict) and "ops" not in value \
+                and "bytes_per_device" not in value:
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.1) \
+        -> List[str]:
+    """Return descriptions of the results of `current` that are more than
+    `threshold` worse than in `baseline`. The `stdlib` reference timings
+    and ratios are not compared."""
+    old = dict(_flatten(baseline["results"]))
+    regressions = []
+    for name, new in _flatten(current["results"]):
+        if name not in old or not isinstance(new, dict) \
+                or ".stdlib." in f".{name}":
+            continue
+        if "ops_per_second" in new:
+            ratio = new["ops_per_second"] / old[name]["ops_per_second"]
+            if ratio < 1 - threshold:
+                regressions.append(
+                    f"{name}: {ratio:.2f}x ops/s of baseline"
+                )
+        elif "bytes_per_device" in new:
+            ratio = new["bytes_per_device"] / old[name]["bytes_per_device"]
+            if ratio > 1 + threshold:
+                regressions.append(
+                    f"{name}: {ratio:.2f}x bytes per device of baseline"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m google_sdm.testing.benchmark",
+        description="Benchmark google_sdm against a synthetic fleet.",
+    )
+    parser.add_argument("--structures", type=int, default=100)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--thermostats", type=int, default=2)
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--doorbells", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", action="append", choices=sorted(BENCHMARKS),
+        help="benchmark to run, may be repeated (default: all)",
+    )
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument(
+        "--compare", help="results file to check for regressions against",
+    )
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = run(
+        {
+            "structures": args.structures,
+            "rooms": args.rooms,
+            "thermostats": args.thermostats,
+            "cameras": args.cameras,
+            "doorbells": args.doorbells,
+        },
+        args.only,
+        args.repeat,
+    )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import json
+import random
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+from ..devices import SDMCamera, SDMDoorbell, SDMThermostat
+from ..utils import timestamp_from_ns
+
+_VIDEO = {"width": 640, "height": 480}
+_IMAGE = {"width": 1920, "height": 1200}
+
+
+def _info(name):
+    return {"sdm.devices.traits.Info": {"customName": name}}
+
+
+def _thermostat_traits(rng, name):
+    heat = round(rng.uniform(17.0, 21.0), 5)
+    traits = _info(name)
+    traits.update({
+        "sdm.devices.traits.Humidity": {
+            "ambientHumidityPercent": rng.randint(25, 60),
+        },
+        "sdm.devices.traits.Connectivity": {"status": "ONLINE"},
+        "sdm.devices.traits.Fan": {"timerMode": "OFF"},
+        "sdm.devices.traits.ThermostatMode": {
+            "mode": "HEATCOOL",
+            "availableModes": ["HEAT", "COOL", "HEATCOOL", "OFF"],
+        },
+        "sdm.devices.traits.ThermostatEco": {
+            "availableModes": ["OFF", "MANUAL_ECO"],
+            "mode": "OFF",
+            "heatCelsius": 4.4444,
+            "coolCelsius": 24.44443,
+        },
+        "sdm.devices.traits.ThermostatHvac": {"status": "OFF"},
+        "sdm.devices.traits.Settings": {"temperatureScale": "CELSIUS"},
+        "sdm.devices.traits.ThermostatTemperatureSetpoint": {
+            "heatCelsius": heat,
+            "coolCelsius": round(heat + rng.uniform(2.0, 5.0), 5),
+        },
+        "sdm.devices.traits.Temperature": {
+            "ambientTemperatureCelsius": round(rng.uniform(16.0, 26.0), 2),
+        },
+    })
+    return traits
+
+
+def _camera_traits(rng, name):
+    traits = _info(name)
+    traits.update({
+        "sdm.devices.traits.CameraLiveStream": {
+            "maxVideoResolution": dict(_VIDEO),
+            "videoCodecs": ["H264"],
+            "audioCodecs": ["AAC"],
+        },
+        "sdm.devices.traits.CameraImage": {
+            "maxImageResolution": dict(_IMAGE),
+        },
+        "sdm.devices.traits.CameraPerson": {},
+        "sdm.devices.traits.CameraSound": {},
+        "sdm.devices.traits.CameraMotion": {},
+        "sdm.devices.traits.CameraEventImage": {},
+    })
+    return traits
+
+
+def _doorbell_traits(rng, name):
+    traits = _camera_traits(rng, name)
+    traits["sdm.devices.traits.DoorbellChime"] = {}
+    return traits
+
+
+_KINDS = (
+    ("thermostats", SDMThermostat.STR_REPR, _thermostat_traits),
+    ("cameras", SDMCamera.STR_REPR, _camera_traits),
+    ("doorbells", SDMDoorbell.STR_REPR, _doorbell_traits),
+)
+
+
+def generate_fleet(
+    project_id: str = "project-id",
+    structures: int = 1,
+    rooms: int = 4,
+    thermostats: int = 2,
+    cameras: int = 2,
+    doorbells: int = 1,
+    seed: int = 0,
+) -> Dict:
+    """Generate a synthetic enterprise, as the SDM API would list it.
+
+    Each of the `structures` has `rooms` rooms and the given number of
+    thermostats, cameras and doorbells, spread over its rooms. Return a
+    dictionary with the `devices` and `structures` listings and the
+    `rooms` listing of each structure, keyed by structure name.
+    """
+    rng = random.Random(seed)
+    fleet = {"devices": [], "structures": [], "rooms": {}}
+    serial = 0
+    for s in range(structures):
+        structure = f"enterprises/{project_id}/structures/S{s:06d}"
+        fleet["structures"].append({
+            "name": structure,
+            "traits": {
+                "sdm.structures.traits.Info": {"customName": f"Home {s}"},
+            },
+        })
+        room_names = [f"{structure}/rooms/R{r:04d}" for r in range(rooms)]
+        fleet["rooms"][structure] = [
+            {
+                "name": room,
+                "traits": {
+                    "sdm.structures.traits.RoomInfo": {
+                        "customName": f"Room {r}",
+                    },
+                },
+            }
+            for r, room in enumerate(room_names)
+        ]
+        counts = {
+            "thermostats": thermostats,
+            "cameras": cameras,
+            "doorbells": doorbells,
+        }
+        for kind, device_type, traits in _KINDS:
+            for index in range(counts[kind]):
+                room = room_names[serial % len(room_names)] \
+                    if room_names else structure
+                fleet["devices"].append({
+                    "name": f"enterprises/{project_id}/devices/D{serial:08d}",
+                    "type": device_type,
+                    "assignee": room,
+                    "traits": traits(rng, f"{kind} {index}"),
+                    "parentRelations": [
+                        {"parent": room, "displayName": f"Room {serial}"},
+                    ],
+                })
+                serial += 1
+    return fleet
+
+
+def generate_events(
+    fleet: Dict,
+    count: int,
+    start_ns: Optional[int] = None,
+    interval_ns: int = 10000000,
+    seed: int = 0,
+) -> Iterator[Dict]:
+    """Generate `count` Pub/Sub `resourceUpdate` messages for random
+    devices of a fleet, `interval_ns` apart from `start_ns` (now by
+    default): temperature and humidity updates for thermostats, motion and
+    person events for cameras and doorbells, and chimes for doorbells."""
+    rng = random.Random(seed)
+    if start_ns is None:
+        start_ns = time.time_ns()
+    devices: List[Dict] = fleet["devices"]
+    for index in range(count):
+        device = devices[rng.randrange(len(devices))]
+        timestamp = timestamp_from_ns(start_ns + index * interval_ns)
+        update = {"name": device["name"]}
+        if device["type"] == SDMThermostat.STR_REPR:
+            if rng.random() < 0.7:
+                update["traits"] = {
+                    "sdm.devices.traits.Temperature": {
+                        "ambientTemperatureCelsius":
+                            round(rng.uniform(16.0, 26.0), 2),
+                    },
+                }
+            else:
+                update["traits"] = {
+                    "sdm.devices.traits.Humidity": {
+                        "ambientHumidityPercent": rng.randint(25, 60),
+                    },
+                }
+        else:
+            event = rng.choice(
+                ["CameraMotion.Motion", "CameraPerson.Person"]
+                + (["DoorbellChime.Chime"]
+                   if device["type"] == SDMDoorbell.STR_REPR else [])
+            )
+            update["events"] = {
+                f"sdm.devices.events.{event}": {
+                    "eventSessionId": f"CjY5Y3VK{index:010d}",
+                    "eventId": f"n:{index}",
+                },
+            }
+        yield {
+            "eventId": str(uuid.UUID(int=(seed << 64) | index)),
+            "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+            + "Z",
+            "resourceUpdate": update,
+            "userId": "AVPHwEuBfnPOnTqzVFT4IONX2Qqhu9EJ4ubO-bNnQ-yi",
+        }
+
+
+def write_capture(path: str, events) -> int:
+    """Write events as a JSONL capture for `SDMReplayEventSource`. Return
+    the number of events written."""
+    written = 0
+    with open(path, "w") as capture:
+        for event in events:
+            capture.write(json.dumps(event))
+            capture.write("\n")
+            written += 1
+    return written
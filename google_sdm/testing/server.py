@@ -0,0 +1,617 @@
+"""Local stand-in of the SDM API, to load-test clients reproducibly.
+
+`SDMStandInServer` serves a synthetic fleet over plain HTTP: the device,
+structure and room listings, the `:executeCommand` endpoint, which mutates
+the traits of thermostats, fans and cameras as the SDM API does, and an
+OAuth token endpoint. Responses can be delayed following a latency
+distribution, and throttling (429) or server errors (5xx) injected at a
+given rate::
+
+    with SDMStandInServer(latency=lognormal(0.05), error_rate=0.01) as sdm:
+        api = SDMAPI(
+            token=sdm.issue_token(),
+            project_id=sdm.project_id,
+            client_id="client-id",
+            client_secret="client-secret",
+            api_url=sdm.url,
+            token_url=sdm.token_url,
+        )
+
+The synchronous client refuses OAuth over plain HTTP unless the
+`OAUTHLIB_INSECURE_TRANSPORT` environment variable is set.
+
+Run `python -m google_sdm.testing.server --help` to serve from a shell.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import secrets
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, Optional, Sequence
+from urllib.parse import parse_qs
+
+from ..utils import timestamp_from_ns
+from .fleet import generate_fleet
+
+LOGGER = logging.getLogger("google-sdm")
+
+_DEVICE = re.compile(r"^/v1/enterprises/([^/]+)/devices/([^/:]+)$")
+_COMMAND = re.compile(
+    r"^/v1/enterprises/([^/]+)/devices/([^/:]+):executeCommand$"
+)
+_DEVICES = re.compile(r"^/v1/enterprises/([^/]+)/devices$")
+_STRUCTURE = re.compile(r"^/v1/enterprises/([^/]+)/structures/([^/]+)$")
+_STRUCTURES = re.compile(r"^/v1/enterprises/([^/]+)/structures$")
+_ROOM = re.compile(
+    r"^/v1/enterprises/([^/]+)/structures/([^/]+)/rooms/([^/]+)$"
+)
+_ROOMS = re.compile(r"^/v1/enterprises/([^/]+)/structures/([^/]+)/rooms$")
+
+_STATUS = {
+    400: "INVALID_ARGUMENT",
+    401: "UNAUTHENTICATED",
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    502: "UNAVAILABLE",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+_TRAITS = "sdm.devices.traits."
+_COMMANDS = "sdm.devices.commands."
+
+
+def constant(seconds: float) -> Callable[[random.Random], float]:
+    """Latency of exactly `seconds`."""
+    return lambda rng: seconds
+
+
+def uniform(low: float, high: float) -> Callable[[random.Random], float]:
+    """Latency uniformly distributed between `low` and `high` seconds."""
+    return lambda rng: rng.uniform(low, high)
+
+
+def exponential(mean: float) -> Callable[[random.Random], float]:
+    """Exponentially distributed latency of `mean` seconds."""
+    return lambda rng: rng.expovariate(1 / mean)
+
+
+def lognormal(median: float, sigma: float = 0.5) \
+        -> Callable[[random.Random], float]:
+    """Log-normally distributed latency of `median` seconds, the usual
+    shape of network latencies with a long tail."""
+    if median <= 0:
+        return constant(0.0)
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class SDMCommandError(Exception):
+    """Rejected command, answered with `status` (an HTTP status code)."""
+
+    def __init__(self, message: str, status: int = 400,
+                 reason: str = "INVALID_ARGUMENT"):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SDMStandIn/1.0"
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"Stand-in: {format % args}")
+
+    def do_GET(self):
+        self.server.stand_in._handle(self, "GET")
+
+    def do_POST(self):
+        self.server.stand_in._handle(self, "POST")
+
+
+class SDMStandInServer:
+    """Local HTTP server standing in for the SDM API and its OAuth token
+    endpoint.
+
+    `fleet` is a `generate_fleet` dictionary (a default fleet is generated
+    for `project_id` if None) and is mutated by the commands. `latency`
+    draws the delay of each response, in seconds, from a `random.Random`;
+    see `constant`, `uniform`, `exponential` and `lognormal`. A fraction
+    `error_rate` of the API requests fail with one of `error_statuses`,
+    carrying a `Retry-After` of `retry_after` seconds if set. Issued access
+    tokens expire after `token_lifetime` seconds. `event_sink`, if set, is
+    called with the `resourceUpdate` message of each trait change, e.g.
+    `SDMQueueEventSource.put`. `seed` makes the latencies and errors
+    reproducible.
+    """
+
+    def __init__(
+        self,
+        fleet: Optional[Dict] = None,
+        project_id: str = "project-id",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: Optional[Callable[[random.Random], float]] = None,
+        error_rate: float = 0.0,
+        error_statuses: Sequence[int] = (429, 503),
+        retry_after: Optional[float] = None,
+        token_lifetime: int = 3600,
+        event_sink: Optional[Callable[[Dict], None]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.fleet = fleet or generate_fleet(project_id=project_id)
+        self.project_id = self._project_of(self.fleet) or project_id
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.event_sink = event_sink
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._devices = {
+            device["name"]: device for device in self.fleet["devices"]
+        }
+        self._structures = {
+            structure["name"]: structure
+            for structure in self.fleet["structures"]
+        }
+        self._rooms = {
+            room["name"]: room
+            for rooms in self.fleet["rooms"].values() for room in rooms
+        }
+        self._access_tokens = {}
+        self._refresh_tokens = set()
+        self._streams = {}
+        self._server = None
+        self._thread = None
+        self._stats = {
+            "requests": 0,
+            "commands": 0,
+            "injected_errors": 0,
+            "unauthorized": 0,
+            "not_modified": 0,
+            "token_refreshes": 0,
+            "latency_seconds": 0.0,
+        }
+
+    @staticmethod
+    def _project_of(fleet):
+        for resource in fleet["devices"] or fleet["structures"]:
+            return resource["name"].split("/")[1]
+        return None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the API, to pass as `api_url`."""
+        return f"http://{self.host}:{self.port}/v1/"
+
+    @property
+    def token_url(self) -> str:
+        """URL of the OAuth token endpoint, to pass as `token_url`."""
+        return f"http://{self.host}:{self.port}/token"
+
+    def start(self) -> "SDMStandInServer":
+        """Start serving in a background thread."""
+        self._server = _ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.stand_in = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name="google-sdm-stand-in",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def issue_token(self, lifetime: Optional[int] = None) -> Dict:
+        """Issue and return an OAuth token, as the token endpoint does."""
+        lifetime = self.token_lifetime if lifetime is None else lifetime
+        access_token = secrets.token_urlsafe(24)
+        refresh_token = secrets.token_urlsafe(24)
+        with self._lock:
+            self._access_tokens[access_token] = time.time() + lifetime
+            self._refresh_tokens.add(refresh_token)
+        return {
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_type": "Bearer",
+            "expires_in": lifetime,
+            "expires_at": time.time() + lifetime,
+            "scope": ["https://www.googleapis.com/auth/sdm.service"],
+        }
+
+    def expire_tokens(self):
+        """Expire every access token issued, as if revoked: requests are
+        then rejected with a 401 until the client refreshes its token."""
+        with self._lock:
+            self._access_tokens.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Return the requests served, commands executed, errors injected,
+        requests rejected as unauthorized, 304 responses, token refreshes
+        and the total latency added."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _handle(self, handler, method):
+        self._count("requests")
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        path = handler.path.split("?", 1)[0]
+
+        if self.latency is not None:
+            with self._lock:
+                delay = max(0.0, self.latency(self._rng))
+            self._count("latency_seconds", delay)
+            time.sleep(delay)
+
+        if path == "/token" and method == "POST":
+            status, payload = self._token(body)
+            return self._reply(handler, status, payload)
+
+        if not path.startswith("/v1/"):
+            return self._error(handler, 404, "Not found")
+
+        with self._lock:
+            inject = self.error_rate and self._rng.random() < self.error_rate
+            status = self._rng.choice(self.error_statuses) if inject else None
+        if inject:
+            self._count("injected_errors")
+            headers = {}
+            if self.retry_after is not None:
+                headers["Retry-After"] = f"{self.retry_after:g}"
+            return self._error(handler, status, "Injected error", headers)
+
+        if not self._authorized(handler.headers.get("Authorization", "")):
+            self._count("unauthorized")
+            return self._error(
+                handler, 401, "Request had invalid authentication credentials"
+            )
+
+        try:
+            if method == "GET":
+                content = self._get(path)
+            else:
+                content = self._post(path, body)
+        except SDMCommandError as e:
+            return self._error(handler, e.status, str(e), reason=e.reason)
+        if content is None:
+            return self._error(handler, 404, f"{path} not found")
+
+        if method == "GET":
+            etag = '"' + hashlib.md5(content).hexdigest() + '"'
+            if handler.headers.get("If-None-Match") == etag:
+                self._count("not_modified")
+                return self._send(handler, 304, b"", {"ETag": etag})
+            return self._send(handler, 200, content, {"ETag": etag})
+        return self._send(handler, 200, content)
+
+    def _authorized(self, authorization):
+        scheme, _, token = authorization.partition(" ")
+        if scheme != "Bearer":
+            return False
+        with self._lock:
+            expires = self._access_tokens.get(token)
+        return expires is not None and expires > time.time()
+
+    def _token(self, body):
+        form = {
+            key: values[0] for key, values in parse_qs(body.decode()).items()
+        }
+        grant = form.get("grant_type")
+        if grant == "refresh_token":
+            with self._lock:
+                known = form.get("refresh_token") in self._refresh_tokens
+            if not known:
+                return 400, {"error": "invalid_grant"}
+        elif grant != "authorization_code":
+            return 400, {"error": "unsupported_grant_type"}
+        self._count("token_refreshes")
+        token = self.issue_token()
+        del token["expires_at"]
+        token["scope"] = " ".join(token["scope"])
+        return 200, token
+
+    def _get(self, path):
+        """Return the JSON content of a resource, or None. Commands change
+        the fleet in place, so it is serialized under the lock."""
+        with self._lock:
+            payload = self._resource(path)
+            return None if payload is None else json.dumps(payload).encode()
+
+    def _resource(self, path):
+        """Return the resource at `path`, or None. Call with the lock."""
+        match = _DEVICES.match(path)
+        if match:
+            return {"devices": list(self._devices.values())}
+        match = _DEVICE.match(path)
+        if match:
+            return self._devices.get(path[len("/v1/"):])
+        match = _STRUCTURES.match(path)
+        if match:
+            return {"structures": list(self._structures.values())}
+        match = _STRUCTURE.match(path)
+        if match:
+            return self._structures.get(path[len("/v1/"):])
+        match = _ROOMS.match(path)
+        if match:
+            rooms = self.fleet["rooms"].get(path[len("/v1/"):-6])
+            return None if rooms is None else {"rooms": rooms}
+        match = _ROOM.match(path)
+        if match:
+            return self._rooms.get(path[len("/v1/"):])
+        return None
+
+    def _post(self, path, body):
+        if not _COMMAND.match(path):
+            return None
+        name = path[len("/v1/"):-len(":executeCommand")]
+        try:
+            request = json.loads(body)
+            command = request["command"]
+            params = request.get("params", {})
+        except (ValueError, KeyError, TypeError):
+            raise SDMCommandError("Invalid command request")
+        self._count("commands")
+        with self._lock:
+            device = self._devices.get(name)
+            if device is None:
+                return None
+            changed = {}
+            result = self._execute(device, command, params, changed)
+        if changed and self.event_sink is not None:
+            self.event_sink(self._event(name, changed))
+        return json.dumps({"results": result}).encode()
+
+    def _execute(self, device, command, params, changed):
+        """Apply `command` to `device`, recording the traits it changed in
+        `changed`, and return the command results."""
+        traits = device["traits"]
+        trait = command[len(_COMMANDS):].split(".", 1)[0]
+        if not command.startswith(_COMMANDS) \
+                or f"{_TRAITS}{trait}" not in traits:
+            raise SDMCommandError(f"Command {command} not supported")
+        method = command[len(_COMMANDS):].replace(".", "_")
+        handler = getattr(self, f"_command_{method}", None)
+        if handler is None:
+            raise SDMCommandError(f"Command {command} not supported")
+        return handler(traits, params, changed) or {}
+
+    @staticmethod
+    def _change(traits, changed, trait, **values):
+        traits[f"{_TRAITS}{trait}"].update(values)
+        changed.setdefault(f"{_TRAITS}{trait}", {}).update(values)
+
+    @staticmethod
+    def _require(params, *keys):
+        missing = [key for key in keys if key not in params]
+        if missing:
+            raise SDMCommandError(f"Missing parameters: {missing}")
+        return [params[key] for key in keys]
+
+    def _command_Fan_SetTimer(self, traits, params, changed):
+        mode, = self._require(params, "timerMode")
+        if mode not in ("ON", "OFF"):
+            raise SDMCommandError(f"Invalid timerMode {mode}")
+        values = {"timerMode": mode}
+        if mode == "ON":
+            duration = float(params.get("duration", "900s").rstrip("s"))
+            values["timerTimeout"] = timestamp_from_ns(
+                time.time_ns() + int(duration * 1e9)
+            ).strftime("%Y-%m-%dT%H:%M:%SZ")
+        else:
+            traits[f"{_TRAITS}Fan"].pop("timerTimeout", None)
+        self._change(traits, changed, "Fan", **values)
+
+    def _set_mode(self, traits, params, changed, trait):
+        mode, = self._require(params, "mode")
+        if mode not in traits[f"{_TRAITS}{trait}"].get("availableModes", ()):
+            raise SDMCommandError(f"Invalid mode {mode}")
+        self._change(traits, changed, trait, mode=mode)
+
+    def _command_ThermostatEco_SetMode(self, traits, params, changed):
+        self._set_mode(traits, params, changed, "ThermostatEco")
+
+    def _command_ThermostatMode_SetMode(self, traits, params, changed):
+        self._set_mode(traits, params, changed, "ThermostatMode")
+
+    def _set_point(self, traits, params, changed, modes, keys):
+        values = dict(zip(keys, self._require(params, *keys)))
+        mode = traits.get(f"{_TRAITS}ThermostatMode", {}).get("mode")
+        eco = traits.get(f"{_TRAITS}ThermostatEco", {}).get("mode")
+        if mode not in modes or eco == "MANUAL_ECO":
+            raise SDMCommandError(
+                f"Cannot set {', '.join(keys)} in mode {mode}",
+                reason="FAILED_PRECONDITION",
+            )
+        setpoint = dict(
+            traits[f"{_TRAITS}ThermostatTemperatureSetpoint"], **values
+        )
+        if setpoint.get("heatCelsius", 0) > setpoint.get("coolCelsius", 99):
+            raise SDMCommandError("heatCelsius is above coolCelsius")
+        self._change(
+            traits, changed, "ThermostatTemperatureSetpoint", **values
+        )
+
+    def _command_ThermostatTemperatureSetpoint_SetHeat(self, traits, params,
+                                                       changed):
+        self._set_point(traits, params, changed, ("HEAT",), ("heatCelsius",))
+
+    def _command_ThermostatTemperatureSetpoint_SetCool(self, traits, params,
+                                                       changed):
+        self._set_point(traits, params, changed, ("COOL",), ("coolCelsius",))
+
+    def _command_ThermostatTemperatureSetpoint_SetRange(self, traits, params,
+                                                        changed):
+        self._set_point(
+            traits, params, changed, ("HEATCOOL",),
+            ("heatCelsius", "coolCelsius"),
+        )
+
+    def _stream(self, token, lifetime=300):
+        expires_at = timestamp_from_ns(time.time_ns() + lifetime * 10 ** 9)
+        self._streams[token] = expires_at
+        return {
+            "streamExtensionToken": token,
+            "streamToken": secrets.token_urlsafe(16),
+            "expiresAt": expires_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        }
+
+    def _command_CameraLiveStream_GenerateRtspStream(self, traits, params,
+                                                     changed):
+        token = secrets.token_urlsafe(16)
+        result = self._stream(token)
+        result["streamUrls"] = {
+            "rtspUrl": f"rtsps://{self.host}:443/{token}"
+            + f"?auth={result['streamToken']}",
+        }
+        return result
+
+    def _command_CameraLiveStream_ExtendRtspStream(self, traits, params,
+                                                   changed):
+        token, = self._require(params, "streamExtensionToken")
+        if token not in self._streams:
+            raise SDMCommandError("Unknown stream", reason="NOT_FOUND")
+        return self._stream(token)
+
+    def _command_CameraLiveStream_StopRtspStream(self, traits, params,
+                                                 changed):
+        token, = self._require(params, "streamExtensionToken")
+        if self._streams.pop(token, None) is None:
+            raise SDMCommandError("Unknown stream", reason="NOT_FOUND")
+
+    def _command_CameraEventImage_GenerateImage(self, traits, params,
+                                                changed):
+        event_id, = self._require(params, "eventId")
+        return {
+            "url": f"http://{self.host}:{self.port}/images/{event_id}",
+            "token": secrets.token_urlsafe(16),
+        }
+
+    def _event(self, name, traits):
+        now = timestamp_from_ns(time.time_ns())
+        return {
+            "eventId": secrets.token_hex(16),
+            "timestamp": now.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "resourceUpdate": {"name": name, "traits": traits},
+            "userId": "stand-in",
+        }
+
+    def _error(self, handler, status, message, headers=None,
+               reason=None):
+        payload = {
+            "error": {
+                "code": status,
+                "message": message,
+                "status": reason or _STATUS.get(status, "UNKNOWN"),
+            },
+        }
+        self._send(handler, status, json.dumps(payload).encode(), headers)
+
+    def _reply(self, handler, status, payload):
+        self._send(handler, status, json.dumps(payload).encode())
+
+    @staticmethod
+    def _send(handler, status, content, headers=None):
+        handler.send_response(status)
+        if content:
+            handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        if content:
+            handler.wfile.write(content)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m google_sdm.testing.server",
+        description="Serve a synthetic fleet as a local SDM API.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--project-id", default="project-id")
+    parser.add_argument("--structures", type=int, default=1)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--thermostats", type=int, default=2)
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--doorbells", type=int, default=1)
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="median latency in seconds, log-normally distributed",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float)
+    parser.add_argument("--token-lifetime", type=int, default=3600)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    server = SDMStandInServer(
+        generate_fleet(
+            project_id=args.project_id,
+            structures=args.structures,
+            rooms=args.rooms,
+            thermostats=args.thermostats,
+            cameras=args.cameras,
+            doorbells=args.doorbells,
+        ),
+        host=args.host,
+        port=args.port,
+        latency=lognormal(args.latency) if args.latency else None,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        token_lifetime=args.token_lifetime,
+        seed=args.seed,
+    )
+    with server:
+        print(f"Serving {server.url}", file=sys.stderr)
+        print(json.dumps(server.issue_token()))
+        try:
+            server._thread.join()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
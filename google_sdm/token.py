@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+LOGGER = logging.getLogger("google-sdm")
+
+# Seconds before expiry at which a token is refreshed
+TOKEN_EXPIRY_MARGIN = 60.0
+
+
+class SDMTokenManager:
+    """Single-flight, proactive refresh of the OAuth token of an `SDMAPI`.
+
+    Concurrent `refresh` calls share one in-flight `SDMAPI.refresh_tokens`
+    call and all return its token. Unless `proactive` is false, a
+    background thread refreshes the token `margin` seconds before it
+    expires, so requests rarely meet an expired token; a failed proactive
+    refresh is retried every `retry_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        margin: float = TOKEN_EXPIRY_MARGIN,
+        proactive: bool = True,
+        retry_interval: float = 30.0,
+    ):
+        self.margin = margin
+        self.proactive = proactive
+        self.retry_interval = retry_interval
+        self.api = None
+        self._lock = threading.Lock()
+        self._flight = None
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._stats = {"refreshes": 0, "joined": 0, "skipped": 0, "failed": 0}
+
+    def attach(self, api):
+        """Manage the token of `api`."""
+        self.api = api
+
+    def _token(self) -> Optional[Dict]:
+        session = self.api._oauth_session
+        return None if session is None else session.token
+
+    def start(self):
+        """Start the proactive refresh thread, if enabled and not running.
+        """
+        with self._lock:
+            if not self.proactive or self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run,
+                name="google-sdm-token",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop the proactive refresh thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopped = True
+        self._wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def notify(self):
+        """Reschedule the proactive refresh after the token was replaced."""
+        self._wakeup.set()
+
+    def expired(self, token: Optional[Dict] = None) -> bool:
+        """Return whether `token`, the current token by default, is expired
+        or expires within `margin` seconds."""
+        if token is None:
+            token = self._token()
+        if not token or token.get("expires_at") is None:
+            return False
+        return token["expires_at"] - time.time() < self.margin
+
+    def refresh_in(self) -> Optional[float]:
+        """Return the seconds until the token is due for a refresh, if its
+        expiry is known."""
+        token = self._token()
+        if not token or token.get("expires_at") is None:
+            return None
+        # Tokens living less than twice the margin are refreshed halfway
+        margin = min(
+            self.margin,
+            float(token.get("expires_in") or 2 * self.margin) / 2,
+        )
+        return token["expires_at"] - margin - time.time()
+
+    def refresh(self, stale_token: Optional[Dict] = None) -> Dict:
+        """Refresh the token and return the new one.
+
+        If a refresh is in flight, wait for it instead of starting
+        another. If `stale_token`, the token the caller found expired or
+        rejected, was already replaced, return the current token.
+        """
+        with self._lock:
+            current = self._token()
+            if stale_token is not None and current is not None and \
+                    current.get("access_token") \
+                    != stale_token.get("access_token"):
+                self._stats["skipped"] += 1
+                return current
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = Future()
+            else:
+                self._stats["joined"] += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            token = self.api.refresh_tokens()
+        except BaseException as e:
+            with self._lock:
+                self._flight = None
+                self._stats["failed"] += 1
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            self._flight = None
+            self._stats["refreshes"] += 1
+        flight.set_result(token)
+        self._wakeup.set()
+        return token
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            if self._stopped:
+                return
+            delay = self.refresh_in()
+            if delay is None:
+                self._wakeup.wait()
+                continue
+            if delay > 0:
+                self._wakeup.wait(delay)
+                continue
+            try:
+                LOGGER.debug("Refreshing tokens ahead of expiry")
+                self.refresh(self._token())
+            except Exception as e:
+                LOGGER.error(f"Proactive token refresh failed: {e}")
+                self._wakeup.wait(self.retry_interval)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the refreshes made, joined to an in-flight refresh,
+        skipped as already done, and failed."""
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,115 @@
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+_CURRENT_SPAN = contextvars.ContextVar("google_sdm_span", default=None)
+
+
+class SDMSpan:
+    """Span returned by an `SDMTracer`. This base class records nothing."""
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def record_exception(self, exception: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+class SDMTracer:
+    """Hooks called around requests, commands, token refreshes and event
+    handling once installed as `SDMAPI.tracer`.
+
+    Spans nest along the `contextvars` context: the span of a Pub/Sub
+    message is the parent of the dispatch queue wait and the device event
+    callback, which is the parent of the commands its listeners execute,
+    and so on down to the HTTP requests and token refreshes.
+    """
+
+    def start_span(self, name: str, parent: Optional[SDMSpan],
+                   attributes: Dict) -> SDMSpan:
+        """Start and return a span, child of `parent` if not None."""
+        return SDMSpan()
+
+
+def current_span() -> Optional[SDMSpan]:
+    """Return the span of the current context, if any."""
+    return _CURRENT_SPAN.get()
+
+
+@contextmanager
+def traced(tracer: SDMTracer, name: str, attributes: Dict = None):
+    """Run the body in a span of `tracer`, child of the current span,
+    recording the exception it raises."""
+    span = tracer.start_span(name, _CURRENT_SPAN.get(), attributes or {})
+    token = _CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        _CURRENT_SPAN.reset(token)
+        span.end()
+
+
+def start_queued(tracer: SDMTracer, name: str, attributes: Dict = None):
+    """Start a span of the time a call waits in a queue and return the
+    arguments to hand to `run_queued` once it is dequeued."""
+    span = tracer.start_span(name, _CURRENT_SPAN.get(), attributes or {})
+    return span, contextvars.copy_context()
+
+
+def run_queued(span: SDMSpan, context: contextvars.Context, func, *args):
+    """End the queue span of `start_queued` and call `func(*args)` in the
+    context it was queued from."""
+    span.end()
+    return context.run(func, *args)
+
+
+class _OpenTelemetrySpan(SDMSpan):
+
+    __slots__ = ("span", "trace")
+
+    def __init__(self, span, trace):
+        self.span = span
+        self.trace = trace
+
+    def set_attribute(self, key, value):
+        self.span.set_attribute(key, value)
+
+    def record_exception(self, exception):
+        self.span.record_exception(exception)
+        self.span.set_status(self.trace.Status(
+            self.trace.StatusCode.ERROR, str(exception)
+        ))
+
+    def end(self):
+        self.span.end()
+
+
+class SDMOpenTelemetryTracer(SDMTracer):
+    """`SDMTracer` reporting to OpenTelemetry, with the given tracer or the
+    one of the global tracer provider. Spans without an SDM parent are
+    children of the current OpenTelemetry span."""
+
+    def __init__(self, tracer=None):
+        try:
+            from opentelemetry import trace
+        except ImportError:  # pragma: no cover
+            raise ImportError(
+                "SDMOpenTelemetryTracer requires the opentelemetry-api "
+                "package"
+            )
+        self.trace = trace
+        self.tracer = tracer or trace.get_tracer("google-sdm")
+
+    def start_span(self, name, parent, attributes):
+        context = None
+        if isinstance(parent, _OpenTelemetrySpan):
+            context = self.trace.set_span_in_context(parent.span)
+        return _OpenTelemetrySpan(self.tracer.start_span(
+            name, context=context, attributes=attributes,
+        ), self.trace)
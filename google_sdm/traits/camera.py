@@ -2,17 +2,13 @@ from .trait import Trait
 
 
 class CameraEventImageTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.CameraEventImage"
+    NAME = "sdm.devices.traits.CameraEventImage"
 
     COMMANDS = {
         "GenerateImage": "sdm.devices.commands.CameraEventImage.GenerateImage",
     }
 
-    def __init__(self, trait_dict):
-        props = {}
-        super().__init__(self, props, trait_dict)
+    PROPS = {}
 
     @staticmethod
     def GenerateImage(device, event_id: str):
@@ -23,21 +19,15 @@ class CameraEventImageTrait(Trait):
 
 
 class CameraImageTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.CameraImage"
+    NAME = "sdm.devices.traits.CameraImage"
 
-    def __init__(self, trait_dict):
-        props = {
-            "max_image_resolution": "maxImageResolution",
-        }
-        super().__init__(self, props, trait_dict)
+    PROPS = {
+        "max_image_resolution": "maxImageResolution",
+    }
 
 
 class CameraLiveStreamTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.CameraLiveStream"
+    NAME = "sdm.devices.traits.CameraLiveStream"
 
     COMMANDS = {
         "GenerateRtspStream":
@@ -48,13 +38,11 @@ class CameraLiveStreamTrait(Trait):
             "sdm.devices.commands.CameraLiveStream.StopRtspStream",
     }
 
-    def __init__(self, trait_dict):
-        props = {
-            "max_video_resolution": "maxVideoResolution",
-            "video_codecs": "videoCodecs",
-            "audio_codecs": "audioCodecs",
-        }
-        super().__init__(self, props, trait_dict)
+    PROPS = {
+        "max_video_resolution": "maxVideoResolution",
+        "video_codecs": "videoCodecs",
+        "audio_codecs": "audioCodecs",
+    }
 
     @staticmethod
     def GenerateRtspStream(device):
@@ -79,30 +67,18 @@ class CameraLiveStreamTrait(Trait):
 
 
 class CameraMotionTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.CameraMotion"
+    NAME = "sdm.devices.traits.CameraMotion"
 
-    def __init__(self, trait_dict):
-        props = {}
-        super().__init__(self, props, trait_dict)
+    PROPS = {}
 
 
 class CameraPersonTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.CameraPerson"
+    NAME = "sdm.devices.traits.CameraPerson"
 
-    def __init__(self, trait_dict):
-        props = {}
-        super().__init__(self, props, trait_dict)
+    PROPS = {}
 
 
 class CameraSoundTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.CameraSound"
+    NAME = "sdm.devices.traits.CameraSound"
 
-    def __init__(self, trait_dict):
-        props = {}
-        super().__init__(self, props, trait_dict)
+    PROPS = {}
@@ -1,11 +1,24 @@
+from functools import wraps
+
 from .trait import Trait
 
 
 def SDMTraitGetter(trait_type):
+    """Pass the `trait_type` view of the object's traits to the getter as
+    the `trait` keyword argument. Views are cached in `_trait_cache` until
+    the owner invalidates them by replacing it, after publishing new
+    traits."""
     def wrap(func):
+        @wraps(func)
         def inner(self, **kwargs):
-            trait_name = trait_type.name()
-            kwargs['trait'] = trait_type(self.traits[trait_name])
+            # Bound before reading the traits: once the owner replaces the
+            # cache, a view of the previous traits lands in the old one
+            cache = self._trait_cache
+            trait = cache.get(trait_type)
+            if trait is None:
+                trait = trait_type(self.traits[trait_type.name()])
+                cache[trait_type] = trait
+            kwargs['trait'] = trait
             return func(self, **kwargs)
         return inner
     return wrap
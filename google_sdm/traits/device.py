@@ -1,41 +1,52 @@
+import time
+
+from ..utils import timestamp_from_ns
 from .trait import Trait
 
 
+# Timer duration of the API when `SetTimer` turns the fan on without one
+_DEFAULT_TIMER_DURATION = "900s"
+
+
+def _set_timer(params):
+    values = {"timerMode": params["timerMode"]}
+    if params["timerMode"] == "ON":
+        duration = params.get("duration", _DEFAULT_TIMER_DURATION)
+        duration = float(duration.rstrip("s"))
+        values["timerTimeout"] = timestamp_from_ns(
+            time.time_ns() + int(duration * 1e9)
+        ).strftime("%Y-%m-%dT%H:%M:%SZ")
+    else:
+        # The timer is off: there is no timeout any more
+        values["timerTimeout"] = None
+    return values
+
+
 class DeviceInfoTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.Info"
+    NAME = "sdm.devices.traits.Info"
 
-    def __init__(self, trait_dict):
-        props = {"custom_name": "customName"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"custom_name": "customName"}
 
 
 class DeviceConnectivityTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.Connectivity"
+    NAME = "sdm.devices.traits.Connectivity"
 
-    def __init__(self, trait_dict):
-        props = {"status": "status"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"status": "status"}
 
 
 class DeviceFanTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.Fan"
+    NAME = "sdm.devices.traits.Fan"
 
     COMMANDS = {
         "SetTimer": "sdm.devices.commands.Fan.SetTimer",
     }
 
-    def __init__(self, trait_dict):
-        props = {
-            "timer_mode": "timerMode",
-            "timer_timeout": "timerTimeout",
-        }
-        super().__init__(self, props, trait_dict)
+    EFFECTS = {"SetTimer": _set_timer}
+
+    PROPS = {
+        "timer_mode": "timerMode",
+        "timer_timeout": "timerTimeout",
+    }
 
     TIMER_MODE_ON = "ON"
     TIMER_MODE_OFF = "OFF"
@@ -49,30 +60,18 @@ class DeviceFanTrait(Trait):
 
 
 class DeviceHumidityTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.Humidity"
+    NAME = "sdm.devices.traits.Humidity"
 
-    def __init__(self, trait_dict):
-        props = {"ambient_humidity_percent": "ambientHumidityPercent"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"ambient_humidity_percent": "ambientHumidityPercent"}
 
 
 class DeviceSettingsTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.Settings"
+    NAME = "sdm.devices.traits.Settings"
 
-    def __init__(self, trait_dict):
-        props = {"temperature_scale": "temperatureScale"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"temperature_scale": "temperatureScale"}
 
 
 class DeviceTemperatureTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.Temperature"
+    NAME = "sdm.devices.traits.Temperature"
 
-    def __init__(self, trait_dict):
-        props = {"ambient_temperature_celsius": "ambientTemperatureCelsius"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"ambient_temperature_celsius": "ambientTemperatureCelsius"}
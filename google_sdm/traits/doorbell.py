@@ -2,10 +2,6 @@ from .trait import Trait
 
 
 class DoorbellChimeTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.CameraMotion"
+    NAME = "sdm.devices.traits.CameraMotion"
 
-    def __init__(self, trait_dict):
-        props = {}
-        super().__init__(self, props, trait_dict)
+    PROPS = {}
@@ -2,20 +2,12 @@ from .trait import Trait
 
 
 class StructureInfoTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.structures.traits.Info"
+    NAME = "sdm.structures.traits.Info"
 
-    def __init__(self, trait_dict):
-        props = {"custom_name": "customName"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"custom_name": "customName"}
 
 
 class StructureRoomInfoTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.structures.traits.RoomInfo"
+    NAME = "sdm.structures.traits.RoomInfo"
 
-    def __init__(self, trait_dict):
-        props = {"custom_name": "customName"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"custom_name": "customName"}
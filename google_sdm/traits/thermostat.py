@@ -1,23 +1,21 @@
-from .trait import Trait
+from .trait import Trait, set_fields
 
 
 class ThermostatEcoTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.ThermostatEco"
+    NAME = "sdm.devices.traits.ThermostatEco"
 
     COMMANDS = {
         "SetMode": "sdm.devices.commands.ThermostatEco.SetMode",
     }
 
-    def __init__(self, trait_dict):
-        props = {
-            "available_modes": "availableModes",
-            "mode": "mode",
-            "heat_celsius": "heatCelsius",
-            "cool_celsius": "coolCelsius",
-        }
-        super().__init__(self, props, trait_dict)
+    EFFECTS = {"SetMode": set_fields("mode")}
+
+    PROPS = {
+        "available_modes": "availableModes",
+        "mode": "mode",
+        "heat_celsius": "heatCelsius",
+        "cool_celsius": "coolCelsius",
+    }
 
     ECO_MODE_ON = "MANUAL_ECO"
     ECO_MODE_OFF = "OFF"
@@ -30,30 +28,24 @@ class ThermostatEcoTrait(Trait):
 
 
 class ThermostatHvacTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.ThermostatHvac"
+    NAME = "sdm.devices.traits.ThermostatHvac"
 
-    def __init__(self, trait_dict):
-        props = {"status": "status"}
-        super().__init__(self, props, trait_dict)
+    PROPS = {"status": "status"}
 
 
 class ThermostatModeTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.ThermostatMode"
+    NAME = "sdm.devices.traits.ThermostatMode"
 
     COMMANDS = {
         "SetMode": "sdm.devices.commands.ThermostatMode.SetMode",
     }
 
-    def __init__(self, trait_dict):
-        props = {
-            "available_modes": "availableModes",
-            "mode": "mode",
-        }
-        super().__init__(self, props, trait_dict)
+    EFFECTS = {"SetMode": set_fields("mode")}
+
+    PROPS = {
+        "available_modes": "availableModes",
+        "mode": "mode",
+    }
 
     THERMOSTAT_MODE_HEAT = "HEAT"
     THERMOSTAT_MODE_COOL = "COOL"
@@ -69,9 +61,7 @@ class ThermostatModeTrait(Trait):
 
 
 class ThermostatTemperatureSetpointTrait(Trait):
-    @staticmethod
-    def name():
-        return "sdm.devices.traits.ThermostatTemperatureSetpoint"
+    NAME = "sdm.devices.traits.ThermostatTemperatureSetpoint"
 
     COMMANDS = {
         "SetHeat":
@@ -82,12 +72,16 @@ class ThermostatTemperatureSetpointTrait(Trait):
             "sdm.devices.commands.ThermostatTemperatureSetpoint.SetRange",
     }
 
-    def __init__(self, trait_dict):
-        props = {
-            "heat_celsius": "heatCelsius",
-            "cool_celsius": "coolCelsius",
-        }
-        super().__init__(self, props, trait_dict)
+    EFFECTS = {
+        "SetHeat": set_fields("heatCelsius"),
+        "SetCool": set_fields("coolCelsius"),
+        "SetRange": set_fields("heatCelsius", "coolCelsius"),
+    }
+
+    PROPS = {
+        "heat_celsius": "heatCelsius",
+        "cool_celsius": "coolCelsius",
+    }
 
     @staticmethod
     def SetHeat(device, heat_celsius: float):
@@ -1,17 +1,79 @@
-from abc import abstractstaticmethod, ABC
+from abc import ABCMeta
 
+# Full command name: (trait name, effect), see `Trait.EFFECTS`
+_EFFECTS = {}
 
-class Trait(ABC):
-    @abstractstaticmethod
-    def name():
-        pass
 
-    def __init__(self, subself, props, trait_dict):
-        for key in props.keys():
-            if props[key] in trait_dict:
-                setattr(subself, key, trait_dict[props[key]])
-            else:
-                setattr(subself, key, None)
+def _compile_init(fields):
+    """Compile an `__init__(self, trait_dict)` assigning every field from
+    its wire key, or its default when the key is missing."""
+    namespace = {}
+    lines = ["def __init__(self, trait_dict):", "    get = trait_dict.get"]
+    for index, (attr, key, default) in enumerate(fields):
+        namespace[f"_default{index}"] = default
+        lines.append(f"    self.{attr} = get({key!r}, _default{index})")
+    exec("\n".join(lines), namespace)
+    return namespace["__init__"]
+
+
+def set_fields(*keys):
+    """Return an effect setting the trait fields `keys` to the command
+    parameters of the same name."""
+    def effect(params):
+        return {key: params[key] for key in keys if key in params}
+    return effect
+
+
+def command_effect(command: str):
+    """Return the trait name and the effect declared for a full command
+    name, or None."""
+    return _EFFECTS.get(command)
+
+
+class TraitMeta(ABCMeta):
+    """Build slotted trait classes out of their declaration.
+
+    A trait declares its `NAME`, its `COMMANDS` and its `PROPS`, which map
+    attribute names to the key of the trait in the SDM resource, or to a
+    `(key, default)` tuple when the default isn't None. The attributes
+    become the class' `__slots__` and `FIELDS`, and are filled by a
+    compiled `__init__`. The `EFFECTS` of its commands are registered for
+    `command_effect`.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        fields = []
+        for base in bases:
+            fields.extend(getattr(base, "FIELDS", ()))
+        inherited = {attr for attr, _, _ in fields}
+        for attr, key in namespace.get("PROPS", {}).items():
+            default = None
+            if isinstance(key, tuple):
+                key, default = key
+            fields.append((attr, key, default))
+        namespace["__slots__"] = tuple(
+            attr for attr, _, _ in fields if attr not in inherited
+        )
+        namespace["FIELDS"] = tuple(fields)
+        namespace["__init__"] = _compile_init(fields)
+        for command, effect in namespace.get("EFFECTS", {}).items():
+            _EFFECTS[namespace["COMMANDS"][command]] = (
+                namespace["NAME"], effect
+            )
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class Trait(metaclass=TraitMeta):
+    NAME = None
+    PROPS = {}
+    COMMANDS = {}
+    # Command: callable mapping its params to the trait fields it sets
+    EFFECTS = {}
+
+    @classmethod
+    def name(cls):
+        return cls.NAME
 
     def __repr__(self):
-        return f"{self.name()}{vars(self)}"
+        values = {attr: getattr(self, attr) for attr, _, _ in self.FIELDS}
+        return f"{self.name()}{values}"
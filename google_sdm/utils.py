@@ -1,4 +1,9 @@
+import os
+import re
+import tempfile
 from collections.abc import Mapping
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Tuple
 
 
 def deep_merge(d, u):
@@ -10,3 +15,117 @@ def deep_merge(d, u):
         else:
             d[k] = v
     return d
+
+
+def deep_merge_copy(d, u) -> Tuple[dict, List[Tuple[str, ...]]]:
+    """Like `deep_merge`, but copy-on-write: `d` is left untouched and the
+    merged dictionary is returned with the key paths of the values that
+    changed, e.g. `("sdm.devices.traits.Temperature",
+    "ambientTemperatureCelsius")`. Updates to the same value are not
+    changes. Only the dictionaries along changed paths are copied, the
+    others are shared with `d`, which is returned as is if nothing
+    changed."""
+    changes = []
+    return _merge_copy(d, u, (), changes), changes
+
+
+def _merge_copy(d, u, path, changes):
+    merged = d
+    for k, v in u.items():
+        if isinstance(v, Mapping):
+            current = merged.get(k)
+            target = current if isinstance(current, dict) else {}
+            value = _merge_copy(target, v, path + (k,), changes)
+            if value is current:
+                continue
+        elif k in merged and merged[k] == v:
+            continue
+        else:
+            value = v
+            changes.append(path + (k,))
+        if merged is d:
+            merged = dict(d)
+        merged[k] = value
+    return merged
+
+
+def atomic_write(path: str, data: bytes):
+    """Write `data` to `path` through a temporary file renamed over it, so
+    readers see the old or the new content, never a partial write."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_ORDINAL = EPOCH.toordinal()
+_FRACTION_SCALE = tuple(10 ** (9 - digits) for digits in range(10))
+_RFC3339 = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)[Tt](\d\d):(\d\d):(\d\d)(?:\.(\d+))?"
+    r"(?:[Zz]|([+-])(\d\d):(\d\d))\Z"
+)
+_SECONDS_CACHE_SIZE = 1024
+# "YYYY-MM-DDTHH:MM:SS." of recent UTC timestamps: their epoch nanoseconds
+_seconds = {}
+
+
+def _parse_timestamp_ns(value):
+    match = _RFC3339.match(value)
+    if match is None:
+        raise ValueError(f"Invalid RFC3339 timestamp: {value!r}")
+    year, month, day, hour, minute, second, fraction, sign, oh, om = \
+        match.groups()
+    seconds = (
+        (date(int(year), int(month), int(day)).toordinal() - _EPOCH_ORDINAL)
+        * 86400 + int(hour) * 3600 + int(minute) * 60 + int(second)
+    )
+    if sign is None and fraction is not None:
+        if len(_seconds) >= _SECONDS_CACHE_SIZE:
+            _seconds.clear()
+        _seconds[value[:20]] = seconds * 1000000000
+    if sign is not None:
+        offset = int(oh) * 3600 + int(om) * 60
+        seconds += offset if sign == "-" else -offset
+    nanoseconds = 0
+    if fraction:
+        fraction = fraction[:9]
+        nanoseconds = int(fraction) * _FRACTION_SCALE[len(fraction)]
+    return seconds * 1000000000 + nanoseconds
+
+
+def parse_timestamp_ns(value: str) -> int:
+    """Parse an RFC3339 timestamp, such as the `timestamp` of SDM events,
+    into integer nanoseconds since the epoch.
+
+    Fractional seconds are optional and of any precision (truncated to
+    nanoseconds). The common `...HH:MM:SS.fffZ` shape is parsed by slicing,
+    reusing the epoch time of recently seen seconds.
+    """
+    seconds = _seconds.get(value[:20])
+    if seconds is not None:
+        fraction = value[20:-1]
+        if value[-1] == "Z" and fraction.isdigit() and len(fraction) <= 9:
+            return seconds + int(fraction) * _FRACTION_SCALE[len(fraction)]
+    return _parse_timestamp_ns(value)
+
+
+def timestamp_from_ns(nanoseconds: int) -> datetime:
+    """Return the UTC `datetime` of nanoseconds since the epoch, truncated
+    to microseconds."""
+    return EPOCH + timedelta(microseconds=nanoseconds // 1000)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an RFC3339 timestamp into a UTC `datetime`."""
+    return timestamp_from_ns(parse_timestamp_ns(value))
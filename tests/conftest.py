@@ -0,0 +1,36 @@
+import pytest
+
+from google_sdm import SDMAPI
+from google_sdm.testing import SDMStandInServer
+
+
+@pytest.fixture
+def sdm(monkeypatch):
+    """A stand-in SDM API server, served over plain HTTP."""
+    monkeypatch.setenv("OAUTHLIB_INSECURE_TRANSPORT", "1")
+    with SDMStandInServer(seed=1) as server:
+        yield server
+
+
+@pytest.fixture
+def connect(sdm):
+    """Return a factory of `SDMAPI` clients of the `sdm` server, closed
+    after the test."""
+    apis = []
+
+    def connect(**kwargs):
+        kwargs.setdefault("token", sdm.issue_token())
+        api = SDMAPI(
+            project_id=sdm.project_id,
+            client_id="client-id",
+            client_secret="client-secret",
+            api_url=sdm.url,
+            token_url=sdm.token_url,
+            **kwargs
+        )
+        apis.append(api)
+        return api
+
+    yield connect
+    for api in apis:
+        api.close()
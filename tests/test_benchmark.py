@@ -0,0 +1,68 @@
+import copy
+import subprocess
+import sys
+
+import pytest
+
+from google_sdm.testing import benchmark
+from google_sdm.testing.fleet import generate_fleet
+
+# Generous bounds: they catch algorithmic regressions, not noise
+
+
+@pytest.fixture(scope="module")
+def fleet():
+    return generate_fleet(structures=5)
+
+
+def test_run_and_compare():
+    results = benchmark.run(
+        {"structures": 2}, ["get_devices", "timestamp"], repeat=1
+    )
+    assert results["meta"]["repeat"] == 1
+    result = results["results"]["get_devices"]
+    assert result["ops"] == results["meta"]["fleet"]["devices"]
+    assert result["ops_per_second"] > 0
+    assert benchmark.compare(results, results) == []
+    slower = copy.deepcopy(results)
+    timings = slower["results"]["timestamp"]
+    timings["parse_timestamp_ns"]["ops_per_second"] /= 10
+    # The stdlib reference timings are not compared
+    timings["stdlib"]["strptime"]["ops_per_second"] /= 10
+    assert benchmark.compare(results, slower) == [
+        "timestamp.parse_timestamp_ns: 0.10x ops/s of baseline"
+    ]
+
+
+def test_timestamps_parse_faster_than_strptime(fleet):
+    speedup = benchmark.bench_timestamp(fleet, 3, events=2000)["speedup"]
+    assert speedup["strptime"] > 3
+
+
+def test_lookup_cost_does_not_grow_with_the_registry(fleet):
+    results = benchmark.bench_lookup(
+        fleet, 3, sizes=(100, 10000), lookups=2000
+    )
+    assert results["10000"]["us_per_op"] < 10 * results["100"]["us_per_op"]
+
+
+def test_filtered_listeners_are_not_slower(fleet):
+    results = benchmark.bench_listeners(fleet, 3, events=2000)
+    assert results["filtered"]["ops_per_second"] \
+        > 0.7 * results["unfiltered"]["ops_per_second"]
+
+
+def test_warm_trait_views_are_faster(fleet):
+    results = benchmark.bench_trait_getters(fleet, 3, calls=20000)
+    assert results["warm"]["ops_per_second"] \
+        > results["cold"]["ops_per_second"]
+
+
+def test_import_is_lazy():
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, google_sdm; print(*sys.modules)"],
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout.split()
+    assert set(benchmark._EAGER_IMPORTS).isdisjoint(loaded)
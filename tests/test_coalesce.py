@@ -0,0 +1,85 @@
+from concurrent.futures import Future
+
+import pytest
+
+from google_sdm.api import SDMError
+from google_sdm.coalesce import SDMCommandCoalescer
+from google_sdm.devices import SDMThermostat
+from google_sdm.traits import (
+    ThermostatModeTrait,
+    ThermostatTemperatureSetpointTrait,
+)
+
+SETPOINT = ThermostatTemperatureSetpointTrait.COMMANDS
+SET_MODE = ThermostatModeTrait.COMMANDS["SetMode"]
+SETPOINT_TRAIT = ThermostatTemperatureSetpointTrait.NAME
+
+
+class Device:
+    name = "enterprises/p/devices/d"
+
+
+def test_merges_setpoints_into_set_range():
+    coalescer = SDMCommandCoalescer()
+    device = Device()
+    first, started = coalescer.submit(
+        device, SETPOINT["SetHeat"], {"heatCelsius": 19.0}
+    )
+    assert started
+    second, started = coalescer.submit(
+        device, SETPOINT["SetCool"], {"coolCelsius": 24.0}
+    )
+    assert not started
+    coalescer.submit(device, SET_MODE, {"mode": "HEAT"})
+    coalescer.submit(device, SET_MODE, {"mode": "HEATCOOL"})
+    taken, commands = coalescer.take(device.name)
+    assert taken is device
+    assert [(command, params) for command, params, _ in commands] == [
+        (SETPOINT["SetRange"], {"heatCelsius": 19.0, "coolCelsius": 24.0}),
+        (SET_MODE, {"mode": "HEATCOOL"}),
+    ]
+    assert commands[0][2] == [first, second]
+    assert coalescer.stats() == {"commands": 4, "sent": 2, "superseded": 2}
+    assert coalescer.take(device.name) == (None, [])
+
+
+def test_setpoints_not_merged():
+    coalescer = SDMCommandCoalescer(merge_setpoints=False)
+    device = Device()
+    coalescer.submit(device, SETPOINT["SetHeat"], {"heatCelsius": 19.0})
+    coalescer.submit(device, SETPOINT["SetCool"], {"coolCelsius": 24.0})
+    coalescer.submit(device, SETPOINT["SetHeat"], {"heatCelsius": 20.0})
+    _, commands = coalescer.take(device.name)
+    assert [(command, params) for command, params, _ in commands] == [
+        (SETPOINT["SetHeat"], {"heatCelsius": 20.0}),
+        (SETPOINT["SetCool"], {"coolCelsius": 24.0}),
+    ]
+
+
+def test_burst_sends_one_command(sdm, connect):
+    api = connect(coalescer=SDMCommandCoalescer(window=0.05, block=False))
+    device = api.get_devices_by_type(SDMThermostat.STR_REPR)[0]
+    commands = sdm.stats()["commands"]
+    heat = ThermostatTemperatureSetpointTrait.SetHeat(device, 18.5)
+    cool = ThermostatTemperatureSetpointTrait.SetCool(device, 25.5)
+    assert isinstance(heat, Future)
+    assert heat.result(5) == cool.result(5)
+    assert sdm.stats()["commands"] == commands + 1
+    assert device.traits[SETPOINT_TRAIT] == {
+        "heatCelsius": 18.5, "coolCelsius": 25.5,
+    }
+
+
+@pytest.mark.parametrize("block", [True, False])
+def test_execute_many_reports_coalesced_errors(connect, block):
+    api = connect(coalescer=SDMCommandCoalescer(window=0.05, block=block))
+    first, second = api.get_devices_by_type(SDMThermostat.STR_REPR)[:2]
+    results = api.execute_many([
+        (first, SET_MODE, {"mode": "BOGUS"}),
+        (second, SET_MODE, {"mode": "HEAT"}),
+    ])
+    assert isinstance(results[0].error, SDMError)
+    assert results[0].result is None
+    assert results[1].error is None
+    assert not isinstance(results[1].result, Future)
+    assert second.get_thermostat_mode().mode == "HEAT"
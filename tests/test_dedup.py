@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+from google_sdm.dedup import SDMEventDeduplicator, peek_event_id
+from google_sdm.devices import SDMThermostat
+from google_sdm.testing.benchmark import fake_api
+from google_sdm.testing.fleet import generate_fleet
+
+TEMPERATURE = "sdm.devices.traits.Temperature"
+
+
+class Message:
+    def __init__(self, event):
+        self.data = json.dumps(event).encode()
+        self.message_id = event.get("eventId", "")
+        self.outcome = None
+
+    def ack(self):
+        self.outcome = "ack"
+
+    def nack(self):
+        self.outcome = "nack"
+
+
+def event(event_id, name, celsius=20.0,
+          timestamp="2030-01-01T00:00:00.000Z"):
+    return {
+        "eventId": event_id,
+        "timestamp": timestamp,
+        "resourceUpdate": {
+            "name": name,
+            "traits": {TEMPERATURE: {"ambientTemperatureCelsius": celsius}},
+        },
+    }
+
+
+@pytest.fixture
+def api():
+    api = fake_api(generate_fleet(structures=1))
+    api.get_devices()
+    return api
+
+
+@pytest.fixture
+def thermostat(api):
+    return api.get_devices_by_type(SDMThermostat.STR_REPR)[0]
+
+
+def handle(api, event):
+    message = Message(event)
+    api._handle_message(message)
+    return message.outcome
+
+
+def test_peek_event_id():
+    assert peek_event_id(b'{"eventId": "abc", "timestamp": "x"}') == "abc"
+    assert peek_event_id(b'{"timestamp": "x", "eventId": "abc"}') is None
+
+
+def test_hits_and_misses():
+    deduplicator = SDMEventDeduplicator()
+    assert not deduplicator.seen("a")
+    assert deduplicator.seen("a")
+    assert not deduplicator.seen("b")
+    deduplicator.forget("a")
+    assert not deduplicator.seen("a")
+    assert deduplicator.stats() == {"hits": 1, "misses": 3, "size": 2}
+
+
+def test_bounded_by_size_and_window():
+    deduplicator = SDMEventDeduplicator(max_size=2)
+    for event_id in ("a", "b", "c"):
+        deduplicator.seen(event_id)
+    assert not deduplicator.seen("a")
+    deduplicator = SDMEventDeduplicator(window=0)
+    deduplicator.seen("a")
+    assert not deduplicator.seen("a")
+
+
+def test_duplicates_are_acked_once_processed(api, thermostat):
+    updates = []
+    thermostat.register_update_listener(updates.append)
+    assert handle(api, event("e1", thermostat.name)) == "ack"
+    assert handle(api, event("e1", thermostat.name, 30.0)) == "ack"
+    assert len(updates) == 1
+    assert thermostat.get_temperature().ambient_temperature_celsius == 20.0
+    assert api.deduplicator.stats()["hits"] == 1
+
+
+def test_failed_events_are_forgotten(api, thermostat):
+    def fail(traits):
+        raise RuntimeError("listener failed")
+
+    thermostat.register_update_listener(fail)
+    assert handle(api, event("e1", thermostat.name)) == "nack"
+    assert not api.deduplicator.seen("e1")
+
+
+@pytest.mark.parametrize("message", [
+    {"eventId": "e1", "resourceUpdate": {}},
+    {"eventId": "e1", "resourceUpdate": {"name": "unknown"}},
+    {"eventId": "e1"},
+])
+def test_unprocessable_events_are_forgotten(api, message):
+    assert handle(api, message) == "nack"
+    assert handle(api, message) == "nack"
+    assert api.deduplicator.stats()["hits"] == 0
+
+
+def test_undecodable_events_are_forgotten(api):
+    message = Message({})
+    message.data = b'{"eventId": "e1", broken'
+    api._handle_message(message)
+    assert message.outcome == "nack"
+    assert not api.deduplicator.seen("e1")
+
+
+def test_opt_out():
+    api = fake_api(generate_fleet(structures=1), deduplicator=False)
+    thermostat = api.get_devices_by_type(SDMThermostat.STR_REPR)[0]
+    updates = []
+    thermostat.register_update_listener(updates.append)
+    handle(api, event("e1", thermostat.name, 20.0))
+    handle(api, event("e1", thermostat.name, 21.0,
+                      "2030-01-01T00:00:01.000Z"))
+    assert api.deduplicator is None
+    assert len(updates) == 2
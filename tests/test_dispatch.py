@@ -0,0 +1,107 @@
+import threading
+import time
+
+from google_sdm.dispatch import SDMEventDispatcher
+from google_sdm.metrics import SDMPrometheusMetrics
+
+
+def test_orders_work_per_key():
+    dispatcher = SDMEventDispatcher(workers=4)
+    runs = {}
+
+    def record(key, index):
+        runs.setdefault(key, []).append(index)
+
+    for index in range(200):
+        key = f"device-{index % 7}"
+        assert dispatcher.submit(key, record, key, index)
+    dispatcher.stop()
+    assert sorted(runs) == [f"device-{key}" for key in range(7)]
+    for key, indexes in runs.items():
+        assert indexes == sorted(indexes)
+    stats = dispatcher.stats()
+    assert stats["submitted"] == stats["completed"] == 200
+    assert stats["depth"] == 0
+
+
+def test_stop_drains_the_queues():
+    dispatcher = SDMEventDispatcher(workers=2)
+    gate = threading.Event()
+    done = []
+    dispatcher.submit("a", gate.wait)
+    for index in range(10):
+        dispatcher.submit("a", done.append, index)
+    threading.Timer(0.1, gate.set).start()
+    dispatcher.stop(timeout=5)
+    assert done == list(range(10))
+
+
+def test_failed_work_is_counted():
+    dispatcher = SDMEventDispatcher(workers=1)
+
+    def fail():
+        raise ValueError("boom")
+
+    dispatcher.submit("a", fail)
+    dispatcher.submit("a", lambda: None)
+    dispatcher.stop()
+    stats = dispatcher.stats()
+    assert stats["failed"] == 1
+    assert stats["completed"] == 1
+
+
+def test_full_queue_rejects():
+    dispatcher = SDMEventDispatcher(workers=1, max_queue=1, put_timeout=0)
+    gate = threading.Event()
+    started = threading.Event()
+    dispatcher.submit("a", lambda: (started.set(), gate.wait()))
+    started.wait(5)
+    assert dispatcher.submit("a", lambda: None)
+    assert not dispatcher.submit("a", lambda: None)
+    assert dispatcher.stats()["rejected"] == 1
+    gate.set()
+    dispatcher.stop(timeout=5)
+
+
+def test_stop_respects_timeout_with_a_full_queue():
+    dispatcher = SDMEventDispatcher(workers=1, max_queue=2, put_timeout=0)
+    gate = threading.Event()
+    started = threading.Event()
+    dispatcher.submit("a", lambda: (started.set(), gate.wait()))
+    started.wait(5)
+    dispatcher.submit("a", lambda: None)
+    dispatcher.submit("a", lambda: None)
+    begun = time.monotonic()
+    dispatcher.stop(timeout=0.5)
+    assert time.monotonic() - begun < 2
+    # The stuck worker still drains its queue, then stops
+    gate.set()
+    deadline = time.monotonic() + 5
+    while dispatcher.stats()["completed"] < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_restarts_after_stop():
+    dispatcher = SDMEventDispatcher(workers=2)
+    dispatcher.submit("a", lambda: None)
+    dispatcher.stop()
+    done = threading.Event()
+    dispatcher.submit("a", done.set)
+    assert done.wait(5)
+    dispatcher.stop()
+
+
+def test_records_metrics():
+    metrics = SDMPrometheusMetrics()
+    dispatcher = SDMEventDispatcher(workers=1, metrics=metrics)
+    for _ in range(3):
+        dispatcher.submit("a", lambda: None)
+    dispatcher.stop()
+    stats = metrics.stats()
+    assert stats["sdm_dispatch_wait_seconds"][()]["count"] == 3
+    assert stats["sdm_dispatch_run_seconds"][()]["count"] == 3
+    assert stats["sdm_dispatch_queue_depth"][()] == 0
+    rendered = metrics.render()
+    assert "# TYPE sdm_dispatch_queue_depth gauge" in rendered
+    assert "sdm_dispatch_queue_depth 0" in rendered
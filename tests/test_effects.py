@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from google_sdm.devices import SDMThermostat
+from google_sdm.testing.benchmark import fake_api
+from google_sdm.testing.fleet import generate_fleet
+from google_sdm.traits.thermostat import ThermostatModeTrait
+
+MODE = ThermostatModeTrait.NAME
+OLDER = "2000-01-01T00:00:00.000Z"
+NEWER = "2100-01-01T00:00:00.000Z"
+
+
+class Message:
+    def __init__(self, event):
+        self.data = json.dumps(event).encode()
+        self.message_id = event["eventId"]
+
+    def ack(self):
+        pass
+
+    def nack(self):
+        pass
+
+
+def send_event(api, device, event_id, timestamp, mode):
+    api._handle_message(Message({
+        "eventId": event_id,
+        "timestamp": timestamp,
+        "resourceUpdate": {
+            "name": device.name,
+            "traits": {MODE: {"mode": mode}},
+        },
+    }))
+
+
+def thermostat_of(api):
+    thermostat = api.get_devices_by_type(SDMThermostat.STR_REPR)[0]
+    # Events from OLDER on are more recent than the listing
+    thermostat.last_updated_ns = 0
+    return thermostat
+
+
+@pytest.fixture
+def api():
+    return fake_api(generate_fleet(structures=1))
+
+
+def mode_of(device):
+    return device.traits[MODE]["mode"]
+
+
+def test_applies_the_effect_of_a_command(api):
+    thermostat = thermostat_of(api)
+    updates = []
+    thermostat.register_update_listener(updates.append, traits=[MODE])
+    ThermostatModeTrait.SetMode(thermostat, "COOL")
+    assert mode_of(thermostat) == "COOL"
+    assert updates == [{MODE: {"mode": "COOL"}}]
+    assert thermostat.last_changes == [f"{MODE}.mode"]
+
+
+def test_older_events_do_not_revert_the_effect(api):
+    thermostat = thermostat_of(api)
+    ThermostatModeTrait.SetMode(thermostat, "COOL")
+    send_event(api, thermostat, "e1", OLDER, "HEAT")
+    assert mode_of(thermostat) == "COOL"
+
+
+def test_newer_events_settle_the_effect(api):
+    thermostat = thermostat_of(api)
+    ThermostatModeTrait.SetMode(thermostat, "COOL")
+    send_event(api, thermostat, "e1", NEWER, "HEAT")
+    assert mode_of(thermostat) == "HEAT"
+    assert thermostat._pending_effects == {}
+
+
+def test_listing_settles_the_effect(api):
+    thermostat = thermostat_of(api)
+    listed = mode_of(thermostat)
+    ThermostatModeTrait.SetMode(thermostat, "COOL")
+    api.get_devices(refresh=True)
+    assert mode_of(thermostat) == listed
+    assert thermostat._pending_effects == {}
+
+
+def test_effect_predating_an_event_is_not_applied(api):
+    thermostat = thermostat_of(api)
+    send_event(api, thermostat, "e1", NEWER, "HEAT")
+    ThermostatModeTrait.SetMode(thermostat, "COOL")
+    assert mode_of(thermostat) == "HEAT"
+    assert thermostat._pending_effects == {}
+
+
+def test_not_optimistic():
+    api = fake_api(generate_fleet(structures=1), optimistic=False)
+    thermostat = thermostat_of(api)
+    listed = mode_of(thermostat)
+    ThermostatModeTrait.SetMode(thermostat, "COOL")
+    assert mode_of(thermostat) == listed
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+from google_sdm import SDMAPI
+from google_sdm.devices import SDMThermostat
+from google_sdm.registry import SDMDeviceRegistry
+
+STRUCTURE = "enterprises/p/structures/S1"
+OTHER = "enterprises/p/structures/S2"
+R1 = f"{STRUCTURE}/rooms/R1"
+R2 = f"{STRUCTURE}/rooms/R2"
+R3 = f"{OTHER}/rooms/R3"
+
+
+def resource(name, parent):
+    return {
+        "name": f"enterprises/p/devices/{name}",
+        "type": SDMThermostat.STR_REPR,
+        "traits": {},
+        "parentRelations": [{"parent": parent, "displayName": name}],
+    }
+
+
+def names(devices):
+    return sorted(device.name.rsplit("/", 1)[1] for device in devices)
+
+
+def load(api, *resources):
+    api._load_devices({"devices": list(resources)})
+
+
+def test_indexes():
+    api = SDMAPI(project_id="p")
+    load(api, resource("A", R1), resource("B", R2), resource("C", R3))
+    assert names(api.get_devices_by_room(R1)) == ["A"]
+    assert names(api.get_devices_by_structure(STRUCTURE)) == ["A", "B"]
+    assert names(api.get_devices_by_structure(OTHER)) == ["C"]
+    assert names(api.get_devices_by_type(SDMThermostat.STR_REPR)) \
+        == ["A", "B", "C"]
+
+
+def test_move():
+    api = SDMAPI(project_id="p")
+    load(api, resource("A", R1), resource("B", R2))
+    device = api.get_device("enterprises/p/devices/A")
+    load(api, resource("A", R3), resource("B", R2))
+    assert api.get_device("enterprises/p/devices/A") is device
+    assert api.get_devices_by_room(R1) == []
+    assert names(api.get_devices_by_room(R3)) == ["A"]
+    assert names(api.get_devices_by_structure(STRUCTURE)) == ["B"]
+    assert names(api.get_devices_by_structure(OTHER)) == ["A"]
+
+
+def test_move_with_add():
+    api = SDMAPI(project_id="p")
+    load(api, resource("A", R1), resource("B", R1))
+    load(api, resource("A", R2), resource("B", R1), resource("C", R1))
+    assert names(api.get_devices_by_room(R1)) == ["B", "C"]
+    assert names(api.get_devices_by_room(R2)) == ["A"]
+
+
+def test_move_with_remove():
+    api = SDMAPI(project_id="p")
+    load(api, resource("A", R1), resource("B", R1))
+    load(api, resource("A", R2))
+    assert api.get_devices_by_room(R1) == []
+    assert names(api.get_devices_by_room(R2)) == ["A"]
+    # A later removal finds the moved device under its new room
+    load(api)
+    # The accessors of an empty registry would fetch the devices
+    assert api._devices.list() == []
+    assert api._devices.by_room(R2) == []
+    assert api._devices.by_structure(STRUCTURE) == []
+
+
+def test_returned_lists_are_copies():
+    api = SDMAPI(project_id="p")
+    load(api, resource("A", R1))
+    api.get_devices().clear()
+    api.get_devices_by_room(R1).clear()
+    assert names(api.get_devices()) == ["A"]
+    assert names(api.get_devices_by_room(R1)) == ["A"]
+
+
+def test_registry_update_keeps_previous_index():
+    registry = SDMDeviceRegistry()
+    a = SimpleNamespace(name="a", type="t", parentRelations=[{"parent": R1}])
+    registry.add(a)
+    devices = iter(registry)
+    b = SimpleNamespace(name="b", type="t", parentRelations=[{"parent": R1}])
+    registry.add(b)
+    # Readers iterating the previous index are unaffected
+    assert list(devices) == [a]
+    assert registry.by_room(R1) == [a, b]
+    assert registry.remove("a") is a
+    assert registry.by_room(R1) == [b]
+    assert registry.remove("a") is None
@@ -0,0 +1,64 @@
+import json
+import sys
+import threading
+
+from google_sdm.devices import SDMThermostat
+from google_sdm.testing import SDMStandInServer
+from google_sdm.traits.device import DeviceFanTrait
+
+SET_TIMER = DeviceFanTrait.COMMANDS["SetTimer"]
+
+
+def test_reads_during_commands(monkeypatch):
+    server = SDMStandInServer(seed=1)
+    name = next(
+        device["name"] for device in server.fleet["devices"]
+        if device["type"] == SDMThermostat.STR_REPR
+    )
+    # Let the commands run while the pure Python encoder serializes
+    monkeypatch.setattr(json.encoder, "c_make_encoder", None)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    stop = threading.Event()
+    errors = []
+
+    def toggle():
+        mode = "ON"
+        while not stop.is_set():
+            server._post(f"/v1/{name}:executeCommand", json.dumps({
+                "command": SET_TIMER,
+                "params": {"timerMode": mode, "duration": "60s"},
+            }).encode())
+            mode = "OFF" if mode == "ON" else "ON"
+
+    def read():
+        for _ in range(5000):
+            try:
+                json.loads(server._get(f"/v1/{name}"))
+            except Exception as e:
+                errors.append(e)
+
+    writer = threading.Thread(target=toggle)
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    try:
+        writer.start()
+        for thread in readers:
+            thread.start()
+        for thread in readers:
+            thread.join()
+    finally:
+        stop.set()
+        writer.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+
+
+def test_serves_the_fleet(sdm, connect):
+    api = connect()
+    assert len(api.get_devices()) == len(sdm.fleet["devices"])
+    device = api.get_devices_by_type(SDMThermostat.STR_REPR)[0]
+    DeviceFanTrait.SetTimer(device, "ON", 60)
+    DeviceFanTrait.SetTimer(device, "OFF", 0)
+    listed = api._get(device.name)
+    assert listed["traits"][DeviceFanTrait.NAME] == {"timerMode": "OFF"}
+    assert sdm.stats()["commands"] == 2
@@ -0,0 +1,49 @@
+from google_sdm.cache import SDMResponseCache
+
+ROOM_INFO = "sdm.structures.traits.RoomInfo"
+
+
+def rename_room(sdm, name):
+    structure, rooms = next(iter(sdm.fleet["rooms"].items()))
+    rooms[0]["traits"][ROOM_INFO]["customName"] = name
+    return structure
+
+
+def room_names(structure):
+    return [room.get_info().custom_name for room in structure.get_rooms()]
+
+
+def test_rooms_are_fetched_on_each_call(sdm, connect):
+    api = connect()
+    structure = api.get_structures()[0]
+    assert "Renamed" not in room_names(structure)
+    rename_room(sdm, "Renamed")
+    assert "Renamed" in room_names(structure)
+
+
+def test_rooms_follow_the_response_cache(sdm, connect):
+    cache = SDMResponseCache(ttls={"rooms": 3600})
+    api = connect(cache=cache)
+    structure = api.get_structures()[0]
+    room_names(structure)
+    rename_room(sdm, "Renamed")
+    assert "Renamed" not in room_names(structure)
+    cache.invalidate()
+    assert "Renamed" in room_names(structure)
+
+
+def test_snapshot_rooms_until_first_fetch(sdm, connect, tmp_path):
+    path = str(tmp_path / "state.json")
+    api = connect()
+    names = room_names(api.get_structures()[0])
+    api.save_snapshot(path)
+    rename_room(sdm, "Renamed")
+
+    requests = sdm.stats()["requests"]
+    offline = connect(token=None, snapshot_path=path)
+    assert room_names(offline.get_structures()[0]) == names
+    assert sdm.stats()["requests"] == requests
+
+    warm = connect(snapshot_path=path)
+    warm._reconciler.join(5)
+    assert "Renamed" in room_names(warm.get_structures()[0])
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from google_sdm.aio import SDMAsyncAPI
+from google_sdm.token import SDMTokenManager
+
+
+class FakeAPI:
+    """The part of `SDMAPI` a token manager relies on."""
+
+    def __init__(self, token, delay=0.0):
+        self._oauth_session = SimpleNamespace(token=token)
+        self.delay = delay
+        self.calls = 0
+
+    def refresh_tokens(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        token = token_expiring_in(3600, f"token-{self.calls}")
+        self._oauth_session.token = token
+        return token
+
+
+def token_expiring_in(seconds, access_token="token-0"):
+    return {
+        "access_token": access_token,
+        "expires_in": seconds,
+        "expires_at": time.time() + seconds,
+    }
+
+
+def manager_of(api, **kwargs):
+    manager = SDMTokenManager(proactive=False, **kwargs)
+    manager.attach(api)
+    return manager
+
+
+def test_expired_within_margin():
+    manager = manager_of(FakeAPI(token_expiring_in(30)), margin=60)
+    assert manager.expired()
+    assert not manager.expired(token_expiring_in(120))
+    assert not manager.expired({"access_token": "a"})
+    manager.api._oauth_session = None
+    assert not manager.expired()
+
+
+def test_concurrent_refreshes_share_one_call():
+    stale = token_expiring_in(0)
+    api = FakeAPI(stale, delay=0.2)
+    manager = manager_of(api)
+    barrier = threading.Barrier(8)
+    tokens = []
+
+    def refresh():
+        barrier.wait()
+        tokens.append(manager.refresh(stale)["access_token"])
+
+    threads = [threading.Thread(target=refresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert api.calls == 1
+    assert tokens == ["token-1"] * 8
+    stats = manager.stats()
+    assert stats["refreshes"] == 1
+    assert stats["joined"] + stats["skipped"] == 7
+
+
+def test_replaced_token_is_not_refreshed_again():
+    stale = token_expiring_in(0)
+    api = FakeAPI(stale)
+    manager = manager_of(api)
+    manager.refresh(stale)
+    assert manager.refresh(stale)["access_token"] == "token-1"
+    assert api.calls == 1
+    assert manager.stats()["skipped"] == 1
+
+
+def test_failed_refresh_is_not_shared_later():
+    api = FakeAPI(token_expiring_in(0))
+    manager = manager_of(api)
+
+    def fail():
+        raise RuntimeError("token endpoint down")
+
+    api.refresh_tokens, refresh_tokens = fail, api.refresh_tokens
+    try:
+        manager.refresh()
+    except RuntimeError:
+        pass
+    api.refresh_tokens = refresh_tokens
+    assert manager.refresh()["access_token"] == "token-1"
+    assert manager.stats()["failed"] == 1
+
+
+def test_async_requests_refresh_within_the_margin(sdm):
+    token = sdm.issue_token(lifetime=30)
+
+    async def main():
+        api = SDMAsyncAPI(
+            project_id=sdm.project_id,
+            client_id="client-id",
+            client_secret="client-secret",
+            api_url=sdm.url,
+            token_url=sdm.token_url,
+            token=token,
+            token_manager=SDMTokenManager(margin=60, proactive=False),
+        )
+        try:
+            await api.get_devices()
+        finally:
+            await api.close()
+        return api
+
+    api = asyncio.run(main())
+    assert api._oauth.token["access_token"] != token["access_token"]
+    assert api.token_manager.stats()["refreshes"] == 1
+    assert sdm.stats()["token_refreshes"] == 1
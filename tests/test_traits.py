@@ -0,0 +1,20 @@
+from google_sdm.devices import SDMThermostat
+from google_sdm.testing.benchmark import fake_api
+from google_sdm.testing.fleet import generate_fleet
+from google_sdm.traits.thermostat import ThermostatModeTrait
+
+
+def test_trait_views_are_cached_until_their_trait_changes():
+    api = fake_api(generate_fleet(structures=1))
+    thermostat = api.get_devices_by_type(SDMThermostat.STR_REPR)[0]
+    mode = thermostat.get_thermostat_mode()
+    temperature = thermostat.get_temperature()
+    assert thermostat.get_thermostat_mode() is mode
+    ThermostatModeTrait.SetMode(thermostat, "COOL")
+    assert thermostat.get_thermostat_mode() is not mode
+    assert thermostat.get_thermostat_mode().mode == "COOL"
+    # Views of the other traits are kept
+    assert thermostat.get_temperature() is temperature
+    api.get_devices(refresh=True)
+    assert thermostat.get_thermostat_mode().mode == mode.mode
+    assert thermostat.get_temperature() is not temperature
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from google_sdm.utils import (
+    deep_merge_copy,
+    parse_timestamp,
+    parse_timestamp_ns,
+    timestamp_from_ns,
+)
+
+SECOND = 1000000000
+# 2020-01-02T03:04:05Z
+BASE = 1577934245 * SECOND
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2020-01-02T03:04:05Z", BASE),
+    ("2020-01-02T03:04:05.1Z", BASE + 100000000),
+    ("2020-01-02T03:04:05.123Z", BASE + 123000000),
+    ("2020-01-02T03:04:05.123456Z", BASE + 123456000),
+    ("2020-01-02T03:04:05.123456789Z", BASE + 123456789),
+    # Truncated to nanoseconds
+    ("2020-01-02T03:04:05.1234567891234Z", BASE + 123456789),
+    ("2020-01-02t03:04:05.5z", BASE + 500000000),
+    ("2020-01-02T05:04:05.5+02:00", BASE + 500000000),
+    ("2020-01-02T01:34:05.5-01:30", BASE + 500000000),
+    ("1970-01-01T00:00:00Z", 0),
+    ("1969-12-31T23:59:59.5Z", -500000000),
+])
+def test_parse_timestamp_ns(value, expected):
+    # Twice, the second time from the recently seen seconds
+    assert parse_timestamp_ns(value) == expected
+    assert parse_timestamp_ns(value) == expected
+
+
+@pytest.mark.parametrize("value", [
+    "",
+    "2020-01-02",
+    "2020-01-02T03:04:05",
+    "2020-01-02T03:04:05.Z",
+    "2020-01-02T03:04:05.12a4Z",
+    "2020-01-02 03:04:05Z",
+    "2020-01-02T03:04:05+0200",
+    "2020-13-02T03:04:05Z",
+    "2020-01-02T03:04:05.123Zjunk",
+])
+def test_parse_timestamp_ns_rejects(value):
+    # Seen seconds don't let malformed timestamps through
+    parse_timestamp_ns("2020-01-02T03:04:05.1Z")
+    with pytest.raises(ValueError):
+        parse_timestamp_ns(value)
+
+
+def test_seen_second_with_offset():
+    parse_timestamp_ns("2020-01-02T03:04:05.1Z")
+    assert parse_timestamp_ns("2020-01-02T03:04:05.1+01:00") \
+        == BASE - 3600 * SECOND + 100000000
+
+
+def test_parse_timestamp():
+    assert parse_timestamp("2020-01-02T03:04:05.123456789Z") == datetime(
+        2020, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc
+    )
+    assert timestamp_from_ns(BASE) == datetime(
+        2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc
+    )
+
+
+def test_deep_merge_copy():
+    shared = {"q": 3}
+    original = {"a": {"x": 1, "y": [1], "z": shared}, "b": {}}
+    merged, changes = deep_merge_copy(
+        original, {"a": {"x": 1, "y": [2], "z": {"q": 3}}}
+    )
+    assert changes == [("a", "y")]
+    assert merged == {"a": {"x": 1, "y": [2], "z": {"q": 3}}, "b": {}}
+    assert original["a"]["y"] == [1]
+    assert merged["b"] is original["b"]
+    assert merged["a"]["z"] is shared
+    same, changes = deep_merge_copy(original, {"a": {"x": 1}})
+    assert same is original
+    assert changes == []